@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from orders.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Give the stock of expired, unpaid order reservations back."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of reservations released per transaction.')
+
+    def handle(self, *args, **options):
+        released = StockReservation.objects.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
@@ -1,4 +1,9 @@
-from django.db import models
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Exists, F, IntegerField, OuterRef
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -6,6 +11,11 @@ from django.core.exceptions import ValidationError
 from uuid import uuid4
 from azbankgateways.models.banks import Bank
 
+from products.autocomplete import autocomplete
+from products.models import Product
+from products.response_cache import response_cache
+from products.utils import bump_catalog_version, per_product
+
 # Create your models here.
 
 class Payment(models.Model):
@@ -45,6 +55,7 @@ class OrderStatusManager:
         self.change_status(Status.PAID)
 
     def cancel(self):
+        StockReservation.objects.release_order(self.order)
         self.change_status(Status.CANCELLED)
 
     def process(self):
@@ -165,3 +176,161 @@ class OrderStatusLog(models.Model):
 
     def __str__(self):
         return f"{self.order.order_number}: {self.old_status} -> {self.new_status}"
+
+
+class InsufficientStock(Exception):
+    """Raised when some products do not have the requested quantity in stock."""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for products {', '.join(map(str, product_ids))}.")
+
+
+class StockReservationManager(models.Manager):
+    """
+    Stock bookkeeping for orders.
+
+    Stock is taken when an order is placed: one conditional
+    `UPDATE ... SET stock = stock - n WHERE stock >= n` covers all of its
+    products, so concurrent checkouts can never oversell and no product
+    row is read and written back. Unpaid reservations expire after
+    `STOCK_RESERVATION_TTL` seconds and give their stock back, as do
+    cancelled orders.
+    """
+
+    def take_stock(self, quantities):
+        if not quantities:
+            return
+        with transaction.atomic():
+            requested = per_product(quantities, IntegerField())
+            updated = Product.objects.filter(id__in=quantities.keys(), stock__gte=requested) \
+                .update(stock=F('stock') - requested, updated=timezone.now())
+            if updated != len(quantities):
+                # rolls back the rows that did have enough stock
+                available = dict(Product.objects.filter(id__in=quantities.keys()).values_list('id', 'stock'))
+                raise InsufficientStock(sorted(
+                    product_id for product_id, quantity in quantities.items()
+                    if available.get(product_id, 0) < quantity))
+        self.changed(quantities)
+
+    def return_stock(self, quantities):
+        if quantities:
+            Product.objects.filter(id__in=quantities.keys()) \
+                .update(stock=F('stock') + per_product(quantities, IntegerField()), updated=timezone.now())
+            self.changed(quantities)
+
+    def changed(self, quantities):
+        # queryset updates skip the product signals, so evict the cached responses and facets here
+        def invalidate():
+            slugs = Product.objects.filter(id__in=quantities.keys()).values_list('slug', flat=True)
+            response_cache.invalidate('product-list', *(f'product:{slug}' for slug in slugs))
+            bump_catalog_version()
+        transaction.on_commit(invalidate)
+
+    def reserve(self, order, items, ttl=None):
+        """
+        Take stock for `items` (`(product_id, quantity)` pairs) and hold it for `order`.
+
+        Raises InsufficientStock, leaving every product untouched, when any
+        of them is short.
+        """
+        quantities = defaultdict(int)
+        for product_id, quantity in items:
+            if quantity <= 0:
+                raise ValueError("Quantity must be positive.")
+            quantities[int(product_id)] += int(quantity)
+
+        ttl = ttl or getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        with transaction.atomic():
+            self.take_stock(quantities)
+            return self.bulk_create([
+                self.model(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+
+    def release(self, reservations):
+        """Give the stock of held `reservations` back; returns how many were released."""
+        with transaction.atomic():
+            rows = list(reservations.filter(status=StockReservation.HELD)
+                        .select_for_update().values_list('id', 'product_id', 'quantity'))
+            if not rows:
+                return 0
+            quantities = defaultdict(int)
+            for _, product_id, quantity in rows:
+                quantities[product_id] += quantity
+            self.filter(id__in=[row[0] for row in rows]).update(status=StockReservation.RELEASED)
+            self.return_stock(quantities)
+        return len(rows)
+
+    def release_order(self, order):
+        return self.release(self.filter(order=order))
+
+    def release_expired(self, batch_size=1000):
+        released = 0
+        while True:
+            ids = list(self.filter(status=StockReservation.HELD, expires_at__lte=timezone.now())
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return released
+            released += self.release(self.filter(id__in=ids))
+
+    def commit(self, order):
+        """
+        Turn the order's reservations into a sale once it is paid.
+
+        Reservations that expired in the meantime take their stock again,
+        which raises InsufficientStock if it was sold in the meantime.
+        """
+        with transaction.atomic():
+            rows = list(self.filter(order=order).exclude(status=StockReservation.COMMITTED)
+                        .select_for_update().values_list('id', 'product_id', 'quantity', 'status'))
+            released = defaultdict(int)
+            sold = defaultdict(int)
+            for _, product_id, quantity, status in rows:
+                sold[product_id] += quantity
+                if status == StockReservation.RELEASED:
+                    released[product_id] += quantity
+
+            self.take_stock(released)
+            self.filter(id__in=[row[0] for row in rows]).update(status=StockReservation.COMMITTED)
+            if sold:
+                now = timezone.now()
+                Product.objects.filter(id__in=sold.keys()) \
+                    .update(sold=F('sold') + per_product(sold, IntegerField()), updated=now)
+                # sold out products are hidden, as before; held stock may still come back
+                held = StockReservation.objects.filter(product=OuterRef('pk'), status=StockReservation.HELD)
+                Product.objects.filter(id__in=sold.keys(), stock=0).exclude(Exists(held)) \
+                    .update(active=False, updated=now)
+                self.changed(sold)
+                autocomplete.update_products(sold.keys())
+        return len(rows)
+
+
+class StockReservation(models.Model):
+    """Stock held for an order until it is paid, cancelled or the hold expires."""
+    HELD = 'HELD'
+    RELEASED = 'RELEASED'
+    COMMITTED = 'COMMITTED'
+    STATUS_CHOICES = [
+        (HELD, _('held')),
+        (RELEASED, _('released')),
+        (COMMITTED, _('committed')),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order.order_number}: {self.product_id} x {self.quantity} ({self.status})"
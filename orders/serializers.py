@@ -1,11 +1,12 @@
 from rest_framework import serializers
 
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import transaction
 
 from accounts.models import CustomUser
 from orders.models import Order
 
-from .models import Order, OrderStatusLog , Address , Payment
+from .models import Order, OrderStatusLog , Address , Payment, StockReservation
 
 # serializers.py
 
@@ -49,14 +50,19 @@ class OrderCreateSerializer(serializers.ModelSerializer):
                 setattr(user, attr, value)
             user.save()
 
-        order = Order.objects.create(
-            user=user,
-            status='PENDING',
-            delivery_time=validated_data['delivery_time'],
-            total_amount=validated_data['total_amount']
-        )
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=user,
+                status='PENDING',
+                delivery_time=validated_data['delivery_time'],
+                total_amount=validated_data['total_amount']
+            )
+
+            # hold the stock until the order is paid; InsufficientStock rolls the order back
+            cart_items = validated_data.pop('cart_items')
+            StockReservation.objects.reserve(
+                order, [(item['product_id'], int(item['quantity'])) for item in cart_items])
 
-        cart_items = validated_data.pop('cart_items')
         for item in cart_items:
             product_id = item['product_id']
             quantity = item['quantity']
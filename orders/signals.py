@@ -1,13 +1,13 @@
 from azbankgateways.models import Bank
 import logging
 
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, pre_delete
 from django.dispatch import receiver
 from django.db import transaction
 from django.utils.translation import gettext as _
 from django.core.exceptions import ValidationError
 
-from .models import Order, OrderStatusLog , OrderStatusManager
+from .models import Order, OrderStatusLog , OrderStatusManager, StockReservation
 
 
 # Signal to update order status after successful payment
@@ -19,19 +19,8 @@ def handle_successful_payment(sender, instance, **kwargs):
             order_manager = OrderStatusManager(order)
             order_manager.process_payment(order.bank_type)
 
-            for item in order.cart_items.all():
-                product = item.product
-                if product.stock >= item.quantity:
-                    product.stock -= item.quantity
-                    product.save()
-
-                    # Deactivate product if stock reaches 0
-                    if product.stock == 0:
-                        product.active = False
-                        product.save()
-                else:
-                    raise ValueError(
-                        f"Insufficient stock for product {product.id}.")
+            # stock was taken when the order was placed; this only settles it
+            StockReservation.objects.commit(order)
 
             # Deactivate all cart items
             order.cart_items.update(active=False)
@@ -76,3 +65,9 @@ def validate_new_order(sender, instance, created, **kwargs):
                 f"New order {instance.order_number} validated successfully")
         except Exception as e:
             logging.error(f"Error in validate_new_order: {str(e)}")
+
+
+# Deleted orders (e.g. a replaced pending order) give their held stock back
+@receiver(pre_delete, sender=Order)
+def release_order_stock(sender, instance, **kwargs):
+    StockReservation.objects.release_order(instance)
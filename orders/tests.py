@@ -1,3 +1,122 @@
-from django.test import TestCase
+import random
+import threading
+import time
 
-# Create your tests here.
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import TransactionTestCase
+
+from accounts.models import CustomUser
+from products.models import Category, Product
+from products.utils import get_catalog_version
+
+from .models import InsufficientStock, Order, StockReservation
+
+
+def retry(operation):
+    """Run `operation`, retrying while SQLite reports lock contention."""
+    for _ in range(1000):
+        try:
+            return operation()
+        except OperationalError as e:
+            # the shared-cache SQLite test database fails instead of waiting for locks
+            if connection.vendor != 'sqlite' or 'locked' not in str(e):
+                raise
+            time.sleep(0.001)
+    raise AssertionError('the database stayed locked')
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    threads = 16
+    orders_per_thread = 25
+    initial_stock = 40
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com', password='x')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        # bulk_create skips the product signals, the search index and image pipeline are not needed here
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Shirt {i}', slug=f'shirt-{i}', color='red', size='LARGE', price=100,
+                    stock=self.initial_stock, category=category, poster='poster/shirt.jpg', active=True)
+            for i in range(4)
+        ])
+        self.product_ids = [product.id for product in self.products]
+
+    def checkout(self, seed, errors):
+        rnd = random.Random(seed)
+        try:
+            for _ in range(self.orders_per_thread):
+                order = retry(lambda: Order.objects.create(user=self.user))
+                items = [(product_id, rnd.randint(1, 4))
+                         for product_id in rnd.sample(self.product_ids, rnd.randint(1, 3))]
+                try:
+                    retry(lambda: StockReservation.objects.reserve(order, items))
+                except InsufficientStock:
+                    continue
+                action = rnd.random()
+                if action < 0.4:
+                    retry(lambda: StockReservation.objects.commit(order))
+                elif action < 0.7:
+                    retry(lambda: StockReservation.objects.release_order(order))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    def test_concurrent_checkouts_never_oversell(self):
+        errors = []
+        workers = [threading.Thread(target=self.checkout, args=(seed, errors)) for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        held = dict(StockReservation.objects.filter(status=StockReservation.HELD)
+                    .values_list('product').annotate(quantity=Sum('quantity')))
+        committed = dict(StockReservation.objects.filter(status=StockReservation.COMMITTED)
+                         .values_list('product').annotate(quantity=Sum('quantity')))
+        self.assertTrue(committed)
+        for product in Product.objects.filter(id__in=self.product_ids):
+            with self.subTest(product=product.slug):
+                self.assertGreaterEqual(product.stock, 0)
+                self.assertEqual(product.sold, committed.get(product.id, 0))
+                self.assertEqual(product.stock + held.get(product.id, 0) + product.sold, self.initial_stock)
+
+    def test_commit_and_release_touch_updated(self):
+        product = self.products[0]
+        order = Order.objects.create(user=self.user)
+        StockReservation.objects.reserve(order, [(product.id, 2)])
+        reserved = Product.objects.get(id=product.id).updated
+
+        StockReservation.objects.commit(order)
+        paid = Product.objects.get(id=product.id)
+        self.assertEqual(paid.sold, 2)
+        self.assertGreater(paid.updated, reserved)
+
+        order = Order.objects.create(user=self.user)
+        StockReservation.objects.reserve(order, [(product.id, 1)])
+        StockReservation.objects.release_order(order)
+        self.assertEqual(Product.objects.get(id=product.id).stock, self.initial_stock - 2)
+
+    def test_sold_out_product_stays_active_while_stock_is_held(self):
+        product = self.products[0]
+        Product.objects.filter(id=product.id).update(stock=3)
+        paid, held = Order.objects.create(user=self.user), Order.objects.create(user=self.user)
+        StockReservation.objects.reserve(paid, [(product.id, 1)])
+        StockReservation.objects.reserve(held, [(product.id, 2)])
+
+        StockReservation.objects.commit(paid)
+        self.assertTrue(Product.objects.get(id=product.id).active)
+        StockReservation.objects.release_order(held)
+        self.assertEqual(Product.objects.get(id=product.id).stock, 2)
+
+        order = Order.objects.create(user=self.user)
+        StockReservation.objects.reserve(order, [(product.id, 2)])
+        StockReservation.objects.commit(order)
+        self.assertFalse(Product.objects.get(id=product.id).active)
+
+    def test_stock_changes_bump_the_catalog_version(self):
+        version = get_catalog_version()
+        StockReservation.objects.reserve(Order.objects.create(user=self.user), [(self.products[0].id, 1)])
+        self.assertNotEqual(get_catalog_version(), version)
@@ -9,7 +9,7 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
-from .models import Payment ,Order, OrderStatusManager , Address
+from .models import Payment ,Order, OrderStatusManager , Address, InsufficientStock
 from . import serializers
 
 # Create your views here.
@@ -76,7 +76,12 @@ class OrderCreateAPIView(APIView):
                 return Response(
                     serializer.errors,
                     status=status.HTTP_400_BAD_REQUEST)
-                
+
+        except InsufficientStock as e:
+            return Response(
+                {"error": str(e), "product_ids": e.product_ids},
+                status=status.HTTP_409_CONFLICT
+            )
         except ValueError as e:
             logger.error(f"Error creating order: {str(e)}")
             return Response(
@@ -7,6 +7,8 @@ from django.utils.translation import gettext_lazy as _
 from django.db.models import Count
 
 from .models import Category, Product, ProductGallery, IpAddress, MostViewed
+from .utils import invalidate_category_tree
+from .response_cache import response_cache
 
 # Register your models here.
 
@@ -14,6 +16,9 @@ from .models import Category, Product, ProductGallery, IpAddress, MostViewed
 @admin.action(description=_('activate'))
 def make_active(self, request, queryset):
     updated = queryset.update(statuses=True)
+    if queryset.model is Category:
+        invalidate_category_tree()
+        response_cache.invalidate('categories')
     status = 'active'
     message = ngettext(
         f'{updated} category was successfully marked as {status}.',
@@ -26,6 +31,9 @@ def make_active(self, request, queryset):
 @admin.action(description=_('inactivate'))
 def make_inactive(self, request, queryset):
     updated = queryset.update(statuses=False)
+    if queryset.model is Category:
+        invalidate_category_tree()
+        response_cache.invalidate('categories')
     status = 'inactive'
     message = ngettext(
         f'{updated}  successfully marked as {status}.',
@@ -121,7 +129,7 @@ class ProductAdmin(admin.ModelAdmin):
     )
 
     def view_count_display(self, obj):
-        count = obj.view_count.count()
+        count = obj.views_count
         return f"{count} view{'s' if count != 1 else ''}"
     view_count_display.short_description = _('View Count')
 
@@ -207,7 +215,8 @@ class IpAddressAdmin(admin.ModelAdmin):
             _last_view=models.Max('mostviewed__created')
         )
 
-    @admin.display(ordering='_views_count', description=_('Views Count'))
+    # older views are compacted into per-product daily totals, without their ip
+    @admin.display(ordering='_views_count', description=_('Recent Views Count'))
     def views_count(self, obj):
         return obj._views_count
 
@@ -5,4 +5,5 @@ class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
 
-
+    def ready(self):
+        import products.signals
@@ -0,0 +1,277 @@
+import heapq
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left, insort
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Q
+
+from .models import Category, Product
+from .search import get_search_terms
+from .utils import ChangeFeed
+
+logger = logging.getLogger(__name__)
+KEY_BYTES = 32
+# a sale counts as much as this many views
+SOLD_WEIGHT = 10
+MAX_SUGGESTIONS = 20
+# top rows of key ranges at least this long are memoized per index
+MEMO_RANGE = 10000
+
+
+def get_index_path():
+    return getattr(settings, 'PRODUCT_AUTOCOMPLETE_INDEX',
+                   os.path.join(settings.BASE_DIR, 'search_index', 'autocomplete.json'))
+
+
+def normalize(text):
+    return ' '.join(get_search_terms(text))
+
+
+def get_prefix_keys(label):
+    """Index keys of `label`: the normalized text from every word on."""
+    terms = get_search_terms(label)
+    return {' '.join(terms[i:]).encode()[:KEY_BYTES] for i in range(len(terms))}
+
+
+class PrefixIndex:
+    """
+    Sorted array of prefix keys for `(id, label, slug, score)` entries.
+
+    Keys are truncated utf-8 byte strings in one numpy array, so a prefix
+    lookup is two `searchsorted` calls and ranking its range is a single
+    `argpartition` over the entry scores; the ranking of very short, very
+    common prefixes is memoized. The arrays are immutable: entries changed
+    after the build live in a small delta with its own sorted key list,
+    and their stale base rows are masked out with `alive`.
+    """
+
+    def __init__(self, entries=()):
+        self.ids, self.labels, self.slugs, scores = [], [], [], []
+        keys, key_rows = [], []
+        for row, (entry_id, label, slug, score) in enumerate(entries):
+            self.ids.append(entry_id)
+            self.labels.append(label)
+            self.slugs.append(slug)
+            scores.append(score)
+            for key in get_prefix_keys(label):
+                keys.append(key)
+                key_rows.append(row)
+
+        keys = np.asarray(keys, dtype=f'S{KEY_BYTES}')
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.key_rows = np.asarray(key_rows, dtype=np.int32)[order]
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.rows = {entry_id: row for row, entry_id in enumerate(self.ids)}
+        self.delta = {}
+        self._delta_keys = []
+        self._top_rows = {}
+
+    def entries(self):
+        for row, entry_id in enumerate(self.ids):
+            if self.alive[row]:
+                yield entry_id, self.labels[row], self.slugs[row], float(self.scores[row])
+        for entry_id, (label, slug, score) in self.delta.items():
+            yield entry_id, label, slug, score
+
+    def get_score(self, entry_id, default=0):
+        if entry_id in self.delta:
+            return self.delta[entry_id][2]
+        row = self.rows.get(entry_id)
+        return float(self.scores[row]) if row is not None and self.alive[row] else default
+
+    def add(self, entry_id, label, slug, score):
+        self.remove(entry_id)
+        self.delta[entry_id] = (label, slug, score)
+        for key in get_prefix_keys(label):
+            insort(self._delta_keys, (key, entry_id))
+
+    def remove(self, entry_id):
+        row = self.rows.get(entry_id)
+        if row is not None:
+            self.alive[row] = False
+        if entry_id in self.delta:
+            label, _, _ = self.delta.pop(entry_id)
+            for key in get_prefix_keys(label):
+                del self._delta_keys[bisect_left(self._delta_keys, (key, entry_id))]
+
+    def rank_rows(self, rows, k):
+        """Return the distinct live rows among `rows` with the `k` best scores."""
+        rows = rows[self.alive[rows]]
+        results = {}
+        limit = k
+        while rows.size:
+            # a title repeating the prefix has several keys, so over-fetch until k distinct
+            limit = min(limit * 4, rows.size)
+            top = rows[np.argpartition(-self.scores[rows], limit - 1)[:limit]]
+            results = dict.fromkeys(top[np.argsort(-self.scores[top], kind='stable')].tolist())
+            if len(results) >= k or limit == rows.size:
+                break
+        return list(results)
+
+    def get_top_rows(self, query, lo, hi, k):
+        if hi - lo < MEMO_RANGE:
+            return self.rank_rows(self.key_rows[lo:hi], k)
+        # rows only ever die, so a memoized ranking stays valid once dead rows are skipped
+        rows = [row for row in self._top_rows.get(query, ()) if self.alive[row]]
+        if len(rows) < k:
+            rows = self._top_rows[query] = self.rank_rows(self.key_rows[lo:hi], MAX_SUGGESTIONS * 2)
+        return rows
+
+    def search(self, prefix, k):
+        """Return up to `k` `(score, id, label, slug)` tuples whose keys start with `prefix`."""
+        query = prefix.encode()[:KEY_BYTES]
+        lo = np.searchsorted(self.keys, query, side='left')
+        # utf-8 never contains 0xff, so this sorts after every key starting with the query
+        hi = np.searchsorted(self.keys, query + b'\xff', side='left')
+
+        rows = self.get_top_rows(query, lo, hi, k)
+        matches = [(float(self.scores[row]), self.ids[row], self.labels[row], self.slugs[row])
+                   for row in rows[:k]]
+        delta_ids = {entry_id for _, entry_id in self._delta_keys[
+            bisect_left(self._delta_keys, (query,)):bisect_left(self._delta_keys, (query + b'\xff',))]}
+        for entry_id in heapq.nlargest(k, delta_ids, key=lambda entry_id: self.delta[entry_id][2]):
+            label, slug, score = self.delta[entry_id]
+            matches.append((score, entry_id, label, slug))
+        if len(prefix.encode()) > KEY_BYTES:
+            # keys are truncated, check the full text of long queries
+            matches = [match for match in matches if prefix in normalize(match[2])]
+
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches[:k]
+
+
+class Autocomplete:
+    """
+    Typeahead suggestions for active product titles and category names.
+
+    The index is loaded from the snapshot written by
+    `rebuild_autocomplete_index`; queries never touch the database. Edits
+    are published to every process through a change feed in the cache and
+    applied to the index on the next query, and each process reloads the
+    snapshot when its file changes, which also folds the accumulated
+    delta back into the sorted arrays, so the rebuild command is meant to
+    run periodically. Without a snapshot the index starts empty.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_index_path()
+        self.products = None
+        self.categories = None
+        self.changes = ChangeFeed('autocomplete')
+        self._position = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_product_entries(product_ids=None):
+        popularity = F('sold') * SOLD_WEIGHT + F('views_count')
+        products = Product.objects.filter(active=True)
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        return products.order_by('id') \
+            .annotate(popularity=popularity) \
+            .values_list('id', 'title', 'slug', 'popularity').iterator(chunk_size=5000)
+
+    @staticmethod
+    def get_category_entries():
+        return Category.objects.filter(statuses=True).order_by('id') \
+            .annotate(popularity=Count('product', filter=Q(product__active=True))) \
+            .values_list('id', 'name', 'slug', 'popularity')
+
+    def build(self):
+        with self._lock:
+            # changes published while the entries are read are applied again
+            self._position = self.changes.get_position()
+            self.products = PrefixIndex(self.get_product_entries())
+            self.categories = PrefixIndex(self.get_category_entries())
+
+    def save(self):
+        with self._lock:
+            data = {'products': list(self.products.entries()),
+                    'categories': list(self.categories.entries()),
+                    'changes': self._position}
+        tmp_path = f'{self.path}.tmp'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            version = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        with self._lock:
+            if self.products is None or version != self._version:
+                if version is None:
+                    logger.warning(f"No autocomplete snapshot at {self.path}, run rebuild_autocomplete_index")
+                    data = {'products': [], 'categories': []}
+                else:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                self.products = PrefixIndex(data['products'])
+                self.categories = PrefixIndex(data['categories'])
+                self._position = data.get('changes') or self.changes.get_position()
+                self._version = version
+            self.apply_changes()
+
+    def apply_changes(self):
+        self._position, changes = self.changes.read(self._position)
+        for kind, entry_id, label, slug, score in changes:
+            index = self.products if kind == 'product' else self.categories
+            if label is None:
+                index.remove(entry_id)
+            else:
+                index.add(entry_id, label, slug, index.get_score(entry_id) if score is None else score)
+
+    def update_product(self, product):
+        if product.active:
+            self.changes.publish([('product', product.pk, product.title, product.slug,
+                                   product.sold * SOLD_WEIGHT + product.views_count)])
+        else:
+            self.remove_product(product.pk)
+
+    def update_products(self, product_ids):
+        """Publish products changed by queryset updates, which send no signals."""
+        product_ids = list(product_ids)
+        entries = {entry[0]: entry for entry in self.get_product_entries(product_ids)}
+        self.changes.publish([('product', *entries[product_id]) if product_id in entries
+                              else ('product', product_id, None, None, None)
+                              for product_id in product_ids])
+
+    def remove_product(self, product_id):
+        self.changes.publish([('product', product_id, None, None, None)])
+
+    def update_category(self, category):
+        if category.statuses:
+            # the product count is kept until the next snapshot
+            self.changes.publish([('category', category.pk, category.name, category.slug, None)])
+        else:
+            self.remove_category(category.pk)
+
+    def remove_category(self, category_id):
+        self.changes.publish([('category', category_id, None, None, None)])
+
+    def suggest(self, query, k=10):
+        prefix = normalize(query)
+        if not prefix:
+            return {'products': [], 'categories': []}
+        self.load()
+
+        k = min(k, MAX_SUGGESTIONS)
+        with self._lock:
+            return {
+                'products': [{'id': entry_id, 'title': label, 'slug': slug}
+                             for _, entry_id, label, slug in self.products.search(prefix, k)],
+                'categories': [{'id': entry_id, 'name': label, 'slug': slug}
+                               for _, entry_id, label, slug in self.categories.search(prefix, k)],
+            }
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,76 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.files.storage import default_storage
+
+from .models import Category, ProductGallery
+
+EXPORT_FIELDS = ['id', 'title', 'slug', 'color', 'size', 'price', 'stock', 'sold',
+                 'description', 'category_id', 'active', 'poster', 'created', 'updated',
+                 'views_count']
+CSV_COLUMNS = [*EXPORT_FIELDS, 'category', 'images']
+
+
+class Echo:
+    """File-like object whose `write` returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+class ProductExporter:
+    """
+    Streams a product queryset chunk by chunk.
+
+    Rows are read with `.values().iterator(chunk_size)` and every chunk
+    fetches its category names and gallery images with one query each, so
+    memory use depends on the chunk size, not the catalog size.
+    """
+
+    def __init__(self, queryset, chunk_size=2000):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self._categories = {}
+
+    def get_category_names(self, category_ids):
+        missing = set(category_ids) - self._categories.keys()
+        if missing:
+            self._categories.update(Category.objects.filter(id__in=missing).values_list('id', 'name'))
+        return self._categories
+
+    def get_images(self, product_ids):
+        images = {product_id: [] for product_id in product_ids}
+        galleries = ProductGallery.objects.filter(product_id__in=product_ids) \
+            .order_by('id').values_list('product_id', 'original_images')
+        for product_id, image in galleries:
+            if image:
+                images[product_id].append(default_storage.url(image))
+        return images
+
+    def chunks(self):
+        rows = self.queryset.order_by('id').values(*EXPORT_FIELDS).iterator(chunk_size=self.chunk_size)
+        while chunk := list(islice(rows, self.chunk_size)):
+            categories = self.get_category_names(row['category_id'] for row in chunk)
+            images = self.get_images([row['id'] for row in chunk])
+            for row in chunk:
+                row['category'] = categories.get(row['category_id'])
+                row['poster'] = default_storage.url(row['poster']) if row['poster'] else None
+                row['images'] = images[row['id']]
+                row['created'] = row['created'].isoformat()
+                row['updated'] = row['updated'].isoformat()
+            yield chunk
+
+    def ndjson(self):
+        for chunk in self.chunks():
+            yield ''.join(json.dumps(row, ensure_ascii=False) + '\n'
+                          for row in chunk)
+
+    def csv(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_COLUMNS)
+        for chunk in self.chunks():
+            yield ''.join(
+                writer.writerow([*(row[field] for field in EXPORT_FIELDS),
+                                 row['category'], '|'.join(row['images'])])
+                for row in chunk)
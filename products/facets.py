@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, Count
+
+from zibanoo.db_router import read_from_primary
+
+from .models import Category
+from .utils import get_catalog_version, get_query_params_key
+
+PRICE_BUCKETS = getattr(settings, 'PRODUCT_PRICE_BUCKETS',
+                        [0, 100000, 250000, 500000, 1000000, 2500000])
+
+
+class ProductFacets:
+    """
+    Facet counts (color, size, category, price bucket) for a filtered queryset.
+
+    Each dimension is one grouped aggregate; on Postgres all of them are
+    computed in a single GROUPING SETS query. Results are cached per
+    normalized filter set and catalog version.
+    """
+    dimensions = ('color', 'size', 'category_id', 'price_bucket')
+    cache_timeout = 300
+    ignored_params = ('page', 'per_page', 'cursor', 'pagination', 'ordering', 'with_count')
+
+    def __init__(self, queryset, buckets=PRICE_BUCKETS):
+        self.queryset = queryset.order_by()
+        self.buckets = list(buckets)
+
+    def get_price_bucket(self):
+        whens = [When(price__lt=upper, then=Value(index))
+                 for index, upper in enumerate(self.buckets[1:])]
+        return Case(*whens, default=Value(len(self.buckets) - 1), output_field=IntegerField())
+
+    def get_bucket_range(self, index):
+        upper = self.buckets[index + 1] if index + 1 < len(self.buckets) else None
+        return self.buckets[index], upper
+
+    def get_grouped_counts(self):
+        """Return `{dimension: {value: count}}`."""
+        queryset = self.queryset.annotate(price_bucket=self.get_price_bucket())
+        if connection.vendor == 'postgresql':
+            return self.get_grouping_sets_counts(queryset)
+
+        return {
+            dimension: dict(queryset.values_list(dimension).annotate(count=Count('id')))
+            for dimension in self.dimensions
+        }
+
+    def get_grouping_sets_counts(self, queryset):
+        sql, params = queryset.values(*self.dimensions).query.sql_with_params()
+        columns = ', '.join(self.dimensions)
+        grouping_sets = ', '.join(f'({dimension})' for dimension in self.dimensions)
+        grouping_flags = ', '.join(f'GROUPING({dimension})' for dimension in self.dimensions)
+
+        counts = {dimension: {} for dimension in self.dimensions}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {columns}, {grouping_flags}, COUNT(*) FROM ({sql}) facets "
+                f"GROUP BY GROUPING SETS ({grouping_sets})", params)
+            size = len(self.dimensions)
+            for row in cursor.fetchall():
+                values, flags, count = row[:size], row[size:-1], row[-1]
+                for dimension, value, flag in zip(self.dimensions, values, flags):
+                    if not flag:
+                        counts[dimension][value] = count
+        return counts
+
+    def compute(self):
+        counts = self.get_grouped_counts()
+        categories = Category.objects.filter(id__in=counts['category_id']) \
+            .values('id', 'name', 'slug')
+
+        price = []
+        for index in range(len(self.buckets)):
+            lower, upper = self.get_bucket_range(index)
+            price.append({'min': lower, 'max': upper,
+                          'count': counts['price_bucket'].get(index, 0)})
+
+        return {
+            'total': sum(counts['color'].values()),
+            'color': self.sort_by_count(
+                {'value': value, 'count': count} for value, count in counts['color'].items()),
+            'size': self.sort_by_count(
+                {'value': value, 'count': count} for value, count in counts['size'].items()),
+            'category': self.sort_by_count(
+                dict(category, count=counts['category_id'][category['id']])
+                for category in categories),
+            'price': price,
+        }
+
+    @staticmethod
+    def sort_by_count(items):
+        return sorted(items, key=lambda item: -item['count'])
+
+    def get(self, query_params):
+        """Return cached facet counts for the given query params."""
+        version = get_catalog_version()
+        cache_key = 'product_facets_{}_{}'.format(
+            version, get_query_params_key(query_params, self.ignored_params))
+        facets = cache.get(cache_key)
+        if facets is None:
+            with read_from_primary(version / 1e9):
+                facets = self.compute()
+            cache.set(cache_key, facets, self.cache_timeout)
+        return facets
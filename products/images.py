@@ -0,0 +1,160 @@
+import atexit
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.dispatch import Signal
+from PIL import Image, features
+from pilkit.processors import ResizeToFill
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = getattr(settings, 'PRODUCT_IMAGE_WIDTHS', [320, 640, 1024])
+DERIVATIVE_FORMATS = getattr(
+    settings, 'PRODUCT_IMAGE_FORMATS',
+    ['webp'] + (['avif'] if features.check('avif') else []))
+DERIVATIVE_DIR = 'derivatives'
+FORMAT_OPTIONS = {
+    'webp': {'quality': 80, 'method': 4},
+    'avif': {'quality': 60},
+    'jpeg': {'quality': 90},
+}
+
+# sent with `pk` after the derivatives of a row have been stored
+derivatives_ready = Signal()
+
+
+def get_content_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def save_image(image, media_root, name, image_format):
+    """Write `image` under `name` unless a file with that content-hashed name exists."""
+    path = os.path.join(media_root, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(path, format=image_format.upper(), **FORMAT_OPTIONS.get(image_format, {}))
+    return name
+
+
+def generate_derivatives(media_root, source_name, widths, formats, fill=None):
+    """
+    Build resized copies of `source_name` (runs in a worker process).
+
+    Returns `{'source': ..., 'fill': name, format: {width: name}}` with
+    file names relative to `media_root`, derived from the source content
+    hash so regenerating an unchanged image is a no-op.
+    """
+    source_path = os.path.join(media_root, source_name)
+    content_hash = get_content_hash(source_path)
+    derivatives = {'source': source_name}
+
+    with Image.open(source_path) as source:
+        source.load()
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        for image_format in formats:
+            derivatives[image_format] = {}
+            for width in sorted(set(min(width, source.width) for width in widths)):
+                height = round(source.height * width / source.width)
+                resized = source if width == source.width else \
+                    source.resize((width, height), Image.Resampling.LANCZOS)
+                name = f'{DERIVATIVE_DIR}/{content_hash[:2]}/{content_hash}-{width}w.{image_format}'
+                derivatives[image_format][str(width)] = save_image(resized, media_root, name, image_format)
+
+        if fill:
+            width, height = fill
+            filled = ResizeToFill(width, height).process(source)
+            name = f'{DERIVATIVE_DIR}/{content_hash[:2]}/{content_hash}-{width}x{height}.jpg'
+            derivatives['fill'] = save_image(filled, media_root, name, 'jpeg')
+    return derivatives
+
+
+class DerivativePipeline:
+    """
+    Generates image derivatives in a background process pool.
+
+    Jobs are submitted after the upload's transaction commits; the result
+    is written back with a queryset `update()` so no save signals fire
+    again.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def submit(self, model, pk, image_field, derivatives_field, fill=None, fill_field=None):
+        """
+        Queue derivative generation for `<image_field>` of the row `pk`.
+
+        With `fill=(width, height)` a cropped JPEG is also produced and
+        stored in `fill_field`.
+        """
+        image_name = model.objects.filter(pk=pk).values_list(image_field, flat=True).first()
+        if not image_name:
+            return None
+        future = self.executor.submit(
+            generate_derivatives, str(settings.MEDIA_ROOT), image_name,
+            DERIVATIVE_WIDTHS, DERIVATIVE_FORMATS, fill)
+        submitter = threading.get_ident()
+        future.add_done_callback(
+            lambda future: self.store(future, model, pk, image_field, image_name,
+                                      derivatives_field, fill_field, submitter))
+        return future
+
+    def store(self, future, model, pk, image_field, image_name, derivatives_field, fill_field,
+              submitter=None):
+        try:
+            derivatives = future.result()
+            updates = {derivatives_field: derivatives}
+            if fill_field and 'fill' in derivatives:
+                updates[fill_field] = derivatives['fill']
+            # skip if the image was replaced while this job was running
+            if model.objects.filter(pk=pk, **{image_field: image_name}).update(**updates):
+                derivatives_ready.send(sender=model, pk=pk)
+        except Exception:
+            logger.exception(f'Failed to generate derivatives for {model.__name__} {pk}')
+        finally:
+            # the callback normally runs on the executor's thread; never close the caller's connection
+            if threading.get_ident() != submitter:
+                connection.close()
+
+
+derivative_pipeline = DerivativePipeline(
+    max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2))
+atexit.register(derivative_pipeline.shutdown)
+
+
+def get_srcset(derivatives):
+    """Map `{format: {width: name}}` to `{format: {width: url}}`."""
+    return {
+        image_format: {width: default_storage.url(name) for width, name in sizes.items()}
+        for image_format, sizes in (derivatives or {}).items()
+        if isinstance(sizes, dict)
+    }
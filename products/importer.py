@@ -0,0 +1,206 @@
+import re
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from .autocomplete import autocomplete
+from .models import Category, Product, COLOR_CHOICES, SIZE_CHOICES
+from .response_cache import response_cache
+from .search import get_search_backend
+from .utils import bump_catalog_version
+
+IMPORT_FIELDS = ('title', 'slug', 'color', 'size', 'price', 'stock', 'sold',
+                 'description', 'category', 'active', 'poster')
+# imported `sold` counts are history, never new sales for the trending scores
+UPDATE_FIELDS = ['title', 'color', 'size', 'price', 'stock', 'sold', 'trending_sold',
+                 'description', 'category', 'active', 'poster', 'updated']
+COLORS = {value for value, _ in COLOR_CHOICES}
+SIZES = {value for value, _ in SIZE_CHOICES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+SUFFIX_RE = re.compile(r'^(.*)-(\d+)$')
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class InvalidRow(ValueError):
+    """A row that cannot be imported."""
+
+
+class SlugAllocator:
+    """
+    Hands out unique product slugs for a batch of titles.
+
+    The next free numeric suffix of recently used bases is kept in a
+    bounded LRU, so new bases cost one query per `load_size` of them
+    instead of one query per row.
+    """
+    max_length = Product._meta.get_field('slug').max_length
+    # bases per query, each one adds a `startswith` condition
+    load_size = 100
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._next = OrderedDict()
+
+    def get_base(self, title):
+        return slugify(title)[:self.max_length - 8].strip('-') or 'product'
+
+    def reserve(self, slugs):
+        """Account for slugs inserted as given so they are never handed out."""
+        for slug in slugs:
+            if slug in self._next:
+                self._remember(slug, max(self._next[slug], 2))
+            match = SUFFIX_RE.match(slug)
+            if match and match.group(1) in self._next:
+                base = match.group(1)
+                self._remember(base, max(self._next[base], int(match.group(2)) + 1))
+
+    def allocate(self, titles):
+        """Return one unique slug per title, none of them taken in the database."""
+        bases = [self.get_base(title) for title in titles]
+        unknown = set(bases) - self._next.keys()
+        if unknown:
+            self._load(unknown)
+
+        slugs = []
+        for base in bases:
+            suffix = self._next[base]
+            slugs.append(base if suffix == 1 else f'{base}-{suffix}')
+            self._remember(base, suffix + 1)
+        return slugs
+
+    def _load(self, bases):
+        # `base-<n>` may be taken even when `base` itself is free
+        bases = list(bases)
+        for base in bases:
+            self._remember(base, 1)
+        for start in range(0, len(bases), self.load_size):
+            chunk = bases[start:start + self.load_size]
+            condition = Q(slug__in=chunk)
+            for base in chunk:
+                condition |= Q(slug__startswith=f'{base}-')
+            self.reserve(Product.objects.filter(condition).values_list('slug', flat=True).iterator())
+
+    def _remember(self, base, suffix):
+        self._next[base] = suffix
+        self._next.move_to_end(base)
+        while len(self._next) > self.max_size:
+            self._next.popitem(last=False)
+
+
+class ProductImporter:
+    """
+    Bulk loads products from an iterable of row dicts.
+
+    Rows are validated, their category slugs resolved through an in-memory
+    map and upserted on `slug` with one `bulk_create(update_conflicts=True)`
+    per batch, each batch in its own transaction. Rows without a slug are
+    always inserted under a freshly allocated one.
+
+    Signals do not fire for bulk inserts, so every batch re-indexes its
+    products for full-text search and autocomplete and evicts their cached
+    responses here.
+    Image derivatives are left for `generate_image_derivatives` and the
+    similarity index for `rebuild_similarity_index`.
+    """
+
+    def __init__(self, update_existing=True):
+        self.update_existing = update_existing
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.slugs = SlugAllocator()
+        self.search_backend = get_search_backend()
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    def clean(self, row):
+        """Return the model field values of an input row."""
+        if not isinstance(row, dict):
+            raise InvalidRow('row is not an object')
+        values = {}
+        for field in IMPORT_FIELDS:
+            value = row.get(field)
+            if not isinstance(value, SCALAR_TYPES):
+                raise InvalidRow(f'{field} must be a string or a number')
+            values[field] = value.strip() if isinstance(value, str) else value
+        if not values['title']:
+            raise InvalidRow('title is required')
+        if values['slug']:
+            # the same checks as the model field, so the slug works in `<slug:slug>` urls
+            try:
+                Product._meta.get_field('slug').run_validators(str(values['slug']))
+            except ValidationError:
+                raise InvalidRow(f"invalid slug {values['slug']!r}")
+            values['slug'] = str(values['slug'])
+        if values['color'] not in COLORS:
+            raise InvalidRow(f"invalid color {values['color']!r}")
+        if values['size'] not in SIZES:
+            raise InvalidRow(f"invalid size {values['size']!r}")
+        category_id = self.categories.get(values.pop('category'))
+        if category_id is None:
+            raise InvalidRow(f"unknown category {row.get('category')!r}")
+        try:
+            values['price'] = int(values['price'])
+            values['stock'] = int(values['stock'] or 0)
+            values['sold'] = int(values['sold'] or 0)
+        except (TypeError, ValueError):
+            raise InvalidRow('price, stock and sold must be integers')
+        active = values['active']
+        values['active'] = active if isinstance(active, bool) else str(active or '').lower() in TRUE_VALUES
+        values['description'] = values['description'] or ''
+        values['poster'] = values['poster'] or ''
+        values['category_id'] = category_id
+        values['trending_sold'] = values['sold']
+        return values
+
+    def import_batch(self, rows):
+        """Import a list of `(line, row)` pairs and return `(line, error)` for rejected rows."""
+        errors, cleaned = [], []
+        for line, row in rows:
+            try:
+                cleaned.append(self.clean(row))
+            except InvalidRow as e:
+                errors.append((line, str(e)))
+        self.skipped += len(errors)
+
+        # later rows win when a batch repeats a slug
+        given = OrderedDict((values['slug'], values) for values in cleaned if values['slug'])
+        generated = [values for values in cleaned if not values['slug']]
+
+        with transaction.atomic():
+            existing = set(Product.objects.filter(slug__in=given.keys()).values_list('slug', flat=True))
+            if not self.update_existing:
+                self.skipped += len(existing)
+                for slug in existing:
+                    del given[slug]
+                existing = set()
+            if given:
+                Product.objects.bulk_create(
+                    [Product(**values) for values in given.values()],
+                    update_conflicts=True, unique_fields=['slug'], update_fields=UPDATE_FIELDS)
+                self.slugs.reserve(given.keys())
+
+            # allocated after the upsert so a generated slug never collides with a given one
+            slugs = self.slugs.allocate([values['title'] for values in generated])
+            for values, slug in zip(generated, slugs):
+                values['slug'] = slug
+            if generated:
+                Product.objects.bulk_create([Product(**values) for values in generated])
+
+            product_ids = list(Product.objects.filter(slug__in=[*given.keys(), *slugs])
+                               .values_list('id', flat=True))
+            self.search_backend.index_products(product_ids)
+            autocomplete.update_products(product_ids)
+
+        self.created += len(given) - len(existing) + len(generated)
+        self.updated += len(existing)
+        if existing:
+            response_cache.invalidate(*(f'product:{slug}' for slug in existing))
+        return errors
+
+    def finish(self):
+        """Evict catalog-wide caches once all batches are in."""
+        bump_catalog_version()
+        response_cache.invalidate('product-list')
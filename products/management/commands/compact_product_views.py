@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.view_stats import RETENTION_DAYS, ViewCompactor
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold MostViewed rows older than the retention period into daily per-product "
+        "totals and delete them. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=RETENTION_DAYS,
+            help='Number of days of raw view rows to keep.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of raw rows deleted per transaction.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        compacted, deleted = ViewCompactor(days=options['days'], batch_size=options['batch_size']).compact()
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {compacted} days and deleted {deleted} view rows in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,37 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from products.images import derivative_pipeline
+from products.models import Product, ProductGallery
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/AVIF derivatives for posters and gallery images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate existing derivatives too.')
+
+    def handle(self, *args, **options):
+        force = options['force']
+        futures = []
+
+        for pk, poster, derivatives in Product.objects.values_list('id', 'poster', 'poster_derivatives').iterator():
+            if poster and (force or derivatives.get('source') != poster):
+                futures.append(derivative_pipeline.submit(Product, pk, 'poster', 'poster_derivatives'))
+
+        for pk, image, derivatives in ProductGallery.objects.values_list('id', 'original_images', 'derivatives').iterator():
+            if image and (force or derivatives.get('source') != image):
+                futures.append(derivative_pipeline.submit(
+                    ProductGallery, pk, 'original_images', 'derivatives',
+                    fill=(300, 400), fill_field='resizes_images'))
+
+        futures = [future for future in futures if future is not None]
+        self.stdout.write(f'Queued {len(futures)} images.')
+        wait(futures)
+        derivative_pipeline.shutdown()
+
+        failed = sum(1 for future in futures if future.exception() is not None)
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {len(futures) - failed} images.'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} images failed, see the log for details.'))
@@ -0,0 +1,84 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import ProductImporter
+
+
+def read_csv(f):
+    for line, row in enumerate(csv.DictReader(f), start=2):
+        yield line, row
+
+
+def read_jsonl(f):
+    for line, text in enumerate(f, start=1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except json.JSONDecodeError:
+            # rejected by ProductImporter.clean like any other malformed row
+            yield line, None
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV or JSONL file into the catalog. Columns: title, slug, "
+        "color, size, price, stock, sold, description, category (slug), active, poster. "
+        "Rows with a slug are upserted, rows without one get a new unique slug."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Input format; guessed from the file extension by default.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows written per transaction.')
+        parser.add_argument(
+            '--no-update', action='store_true',
+            help='Skip rows whose slug already exists instead of updating them.')
+        parser.add_argument(
+            '--max-errors', type=int, default=20,
+            help='Number of rejected rows reported individually.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if input_format not in READERS:
+            raise CommandError('Cannot guess the input format, pass --format csv or --format jsonl.')
+
+        importer = ProductImporter(update_existing=not options['no_update'])
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        started = time.monotonic()
+        processed = errors = 0
+        try:
+            rows = READERS[input_format](f)
+            while batch := list(islice(rows, options['batch_size'])):
+                for line, error in importer.import_batch(batch):
+                    errors += 1
+                    if errors <= options['max_errors']:
+                        self.stderr.write(f'line {line}: {error}')
+                processed += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{processed} rows processed ({processed / elapsed:.0f} rows/s)')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            importer.finish()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {processed} rows in {elapsed:.1f}s: {importer.created} created, '
+            f'{importer.updated} updated, {importer.skipped} skipped.'))
+        self.stdout.write(
+            'Run generate_image_derivatives and rebuild_similarity_index to finish processing '
+            'the imported products.')
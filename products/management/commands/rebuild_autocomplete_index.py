@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import Autocomplete
+
+
+class Command(BaseCommand):
+    help = "Rebuild the autocomplete snapshot with fresh popularity scores."
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = Autocomplete()
+        index.build()
+        index.save()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(index.products.ids)} products and {len(index.categories.ids)} categories '
+            f'into {index.path} in {time.monotonic() - started:.1f}s.'))
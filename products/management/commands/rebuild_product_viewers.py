@@ -0,0 +1,44 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from products.models import DailyProductViews, MostViewed, ProductViewer
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per (product, user) ProductViewer rollup from MostViewed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rollup rows inserted per batch.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild even though compacted views can no longer be attributed to users.')
+
+    def handle(self, *args, **options):
+        if DailyProductViews.objects.exists() and not options['force']:
+            raise CommandError(
+                'Some views were compacted into daily totals without their users, rebuilding would '
+                'drop them from the rollup. Pass --force to rebuild from the remaining rows anyway.')
+
+        batch_size = options['batch_size']
+        rows = MostViewed.objects.values('product', 'user') \
+            .annotate(count=Count('id')) \
+            .order_by() \
+            .iterator(chunk_size=batch_size)
+
+        created = 0
+        with transaction.atomic():
+            ProductViewer.objects.all().delete()
+            while True:
+                batch = [ProductViewer(product_id=row['product'], user_id=row['user'], view_count=row['count'])
+                         for row in islice(rows, batch_size)]
+                if not batch:
+                    break
+                ProductViewer.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} product viewer rows.'))
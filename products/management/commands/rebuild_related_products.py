@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.related import CoViewMatrix
+
+
+class Command(BaseCommand):
+    help = "Rebuild the co-viewed related products of every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, default=10, help='Related products kept per product.')
+        parser.add_argument(
+            '--min-common', type=int, default=2,
+            help='Minimum number of shared viewers for two products to be related.')
+        parser.add_argument(
+            '--max-user-items', type=int, default=500,
+            help='Ignore users who viewed more products than this.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=100000,
+            help='Number of viewer rows fetched per database round trip.')
+        parser.add_argument(
+            '--block-size', type=int, default=2000,
+            help='Number of products scored and written per transaction.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        matrix = CoViewMatrix.from_database(
+            chunk_size=options['chunk_size'], max_user_items=options['max_user_items'])
+        self.stdout.write(
+            f'Loaded {matrix.matrix.nnz} views of {len(matrix.product_ids)} products '
+            f'by {matrix.matrix.shape[0]} users in {time.monotonic() - started:.1f}s.')
+
+        saved = matrix.save(
+            top_n=options['top_n'], min_common=options['min_common'], block_size=options['block_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {saved} related products in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Drop and rebuild the product full-text search index."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic(), connection.cursor() as cursor:
+            backend.drop_index(cursor)
+            backend.create_index(cursor)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt search index using {type(backend).__name__}.'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.similarity import TfidfMatrix, get_index_dir
+
+
+class Command(BaseCommand):
+    help = "Rebuild the TF-IDF product similarity index on disk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of products fetched per database round trip.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        matrix = TfidfMatrix.from_database(chunk_size=options['chunk_size'])
+        path = get_index_dir()
+        matrix.save(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(matrix.product_ids)} products and {len(matrix.vocabulary)} terms '
+            f'into {path} in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from products.models import Product
+from products.response_cache import response_cache
+from products.view_stats import total_views
+
+
+class Command(BaseCommand):
+    help = "Rebuild Product.views_count from the MostViewed table and its compacted daily totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of product ids updated per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+        updated = 0
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                updated += Product.objects \
+                    .filter(id__gte=start, id__lt=start + batch_size) \
+                    .update(views_count=total_views())
+        # the listing's ETag is its cache tag version
+        response_cache.invalidate('product-list')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt view counts for {updated} products.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.response_cache import response_cache
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss statistics of the product API response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing.')
+
+    def handle(self, *args, **options):
+        stats = response_cache.get_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}  misses: {stats['misses']}  hit ratio: {stats['hit_ratio']}")
+        if options['reset']:
+            response_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
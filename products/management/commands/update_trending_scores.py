@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.trending import TrendingScores
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold the product views, sales and ratings since the previous run into the "
+        "time-decayed trending scores. Meant to run every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Number of events scored per transaction.')
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Recompute every score from scratch, e.g. after changing the weights or half-life.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        trending = TrendingScores(chunk_size=options['chunk_size'])
+        if options['reset']:
+            trending.reset()
+        updated = trending.update()
+        self.stdout.write(self.style.SUCCESS(
+            f'Applied {updated} score updates in {time.monotonic() - started:.1f}s.'))
@@ -1,23 +1,162 @@
+import atexit
+import ipaddress
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, connection
+from django.utils.functional import SimpleLazyObject
+
 from .models import IpAddress
 
+logger = logging.getLogger(__name__)
+
+
+def normalize_ip(ip):
+    """Return `ip` as the IpAddress column stores it, or None for anything that is not an address."""
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return IpAddress._meta.get_field('ip_address').to_python(ip)
+
+
+class IpAddressResolver:
+    """
+    Process-local ip -> IpAddress id resolver.
+
+    Known addresses are served from a bounded LRU without touching the
+    database. Unknown addresses are buffered and bulk-inserted by a
+    background thread every `flush_interval` seconds, or as soon as
+    `flush_size` are buffered; requests never wait for those inserts.
+    Values that are not IP addresses are never buffered.
+    """
+
+    def __init__(self, max_size=10000, flush_size=100, flush_interval=5):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._ids = OrderedDict()
+        self._pending = set()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def touch(self, ip):
+        """Record a hit for `ip` without any synchronous query."""
+        ip = normalize_ip(ip)
+        if ip is None:
+            return
+        with self._lock:
+            if ip in self._ids:
+                self._ids.move_to_end(ip)
+                return
+            self._pending.add(ip)
+            full = len(self._pending) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ip-addresses', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def resolve(self, ip):
+        """Return the IpAddress for `ip`, flushing or querying only on a cache miss."""
+        ip = normalize_ip(ip)
+        if ip is None:
+            return None
+        with self._lock:
+            ip_id = self._ids.get(ip)
+            if ip_id is None:
+                self._pending.add(ip)
+        if ip_id is None:
+            self.flush()
+            with self._lock:
+                ip_id = self._ids.get(ip)
+        if ip_id is None:
+            return None
+        return IpAddress(id=ip_id, ip_address=ip)
+
+    def flush(self):
+        """Bulk-insert buffered addresses and cache their ids."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            if not pending:
+                return
+            # the queries run without _lock, so requests are never blocked on them
+            try:
+                known = dict(IpAddress.objects.filter(ip_address__in=pending)
+                             .values_list('ip_address', 'id'))
+                missing = pending - known.keys()
+                if missing:
+                    IpAddress.objects.bulk_create(
+                        [IpAddress(ip_address=ip) for ip in missing])
+                    known.update(IpAddress.objects.filter(ip_address__in=missing)
+                                 .values_list('ip_address', 'id'))
+            except DataError as e:
+                # retrying would fail the same way and block every later address
+                logger.warning(f"Dropping {len(pending)} unstorable IP addresses: {e}")
+                return
+            except DatabaseError:
+                # keep the addresses buffered and retry on the next flush
+                with self._lock:
+                    self._pending |= pending
+                return
+            with self._lock:
+                for ip, ip_id in known.items():
+                    self._remember(ip, ip_id)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            connection.close_if_unusable_or_obsolete()
+            self.flush()
+
+    def _reset_after_fork(self):
+        # the flush thread and locks do not survive fork; pending addresses stay with the parent
+        self._thread = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _remember(self, ip, ip_id):
+        self._ids[ip] = ip_id
+        self._ids.move_to_end(ip)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+
+ip_resolver = IpAddressResolver(
+    max_size=getattr(settings, 'IP_RESOLVER_CACHE_SIZE', 10000),
+    flush_size=getattr(settings, 'IP_RESOLVER_FLUSH_SIZE', 100),
+    flush_interval=getattr(settings, 'IP_RESOLVER_FLUSH_INTERVAL', 5),
+)
+atexit.register(ip_resolver.flush)
+os.register_at_fork(after_in_child=ip_resolver._reset_after_fork)
+
+
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
 
 class SimpleMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-
-        try:
-            ip_address = IpAddress.objects.get(ip_address=ip)
-        except IpAddress.DoesNotExist:
-            ip_address = IpAddress(ip_address=ip)
-            ip_address.save()
-        request.META['ip_address'] = ip_address
+        ip = get_client_ip(request)
+
+        # the IpAddress row is only resolved when a view actually reads it
+        ip_resolver.touch(ip)
+        request.META['ip_address'] = SimpleLazyObject(lambda: ip_resolver.resolve(ip))
 
         response = self.get_response(request)
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ipaddress',
+            name='ip_address',
+            field=models.GenericIPAddressField(db_index=True, verbose_name='آدرس آیپی'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 02:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_views_count(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    MostViewed = apps.get_model('products', 'MostViewed')
+    counts = MostViewed.objects.filter(product=OuterRef('pk')) \
+        .values('product') \
+        .annotate(count=Count('id')) \
+        .values('count')
+    Product.objects.update(views_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_ipaddress_ip_address_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='views_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='تعداد بازدید'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-views_count', '-id'], name='product_views_count_idx'),
+        ),
+        migrations.RunPython(populate_views_count, migrations.RunPython.noop),
+    ]
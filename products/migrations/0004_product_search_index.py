@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# the search index as of this migration; products.search may change later
+CREATE_INDEX_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5("
+        "title, description, category, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+        "INSERT OR REPLACE INTO products_product_fts(rowid, title, description, category) "
+        "SELECT p.id, p.title, p.description, c.name "
+        "FROM products_product p JOIN products_category c ON c.id = p.category_id",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS products_product_search ("
+        "product_id bigint PRIMARY KEY REFERENCES products_product(id) "
+        "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS products_product_search_document_gin "
+        "ON products_product_search USING GIN (document)",
+        "INSERT INTO products_product_search(product_id, document) "
+        "SELECT p.id, "
+        "setweight(to_tsvector('simple', coalesce(p.title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(c.name, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(p.description, '')), 'C') "
+        "FROM products_product p JOIN products_category c ON c.id = p.category_id "
+        "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+    ],
+}
+DROP_INDEX_SQL = {
+    'sqlite': ["DROP TABLE IF EXISTS products_product_fts"],
+    'postgresql': ["DROP TABLE IF EXISTS products_product_search"],
+}
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        # other databases search with icontains and have no index
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_views_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(CREATE_INDEX_SQL), run_sql(DROP_INDEX_SQL)),
+    ]
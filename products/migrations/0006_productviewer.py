@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-18 02:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_product_viewers(apps, schema_editor):
+    MostViewed = apps.get_model('products', 'MostViewed')
+    ProductViewer = apps.get_model('products', 'ProductViewer')
+    rows = MostViewed.objects.values('product', 'user').annotate(count=Count('id')).order_by()
+    ProductViewer.objects.bulk_create(
+        (ProductViewer(product_id=row['product'], user_id=row['user'], view_count=row['count'])
+         for row in rows.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_ordering_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='viewers', to='products.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-view_count'], name='product_top_viewers_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'user'), name='unique_product_viewer')],
+            },
+        ),
+        migrations.RunPython(populate_product_viewers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productviewer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='poster_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productgallery',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
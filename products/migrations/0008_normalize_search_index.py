@@ -0,0 +1,95 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# products.normalization and the search index as of this migration
+CHARACTER_MAP = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    **{digit: str(value) for value, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{digit: str(value) for value, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+IGNORED_RE = re.compile(r'[\u064b-\u065f\u0670\u0640\u200b\u200d-\u200f\ufeff]')
+ZWNJ = '\u200c'
+COMPOUND_RE = re.compile(r'\w+(?:\u200c\w+)+')
+
+DOCUMENTS_SQL = (
+    "SELECT p.id, p.title, p.description, c.name "
+    "FROM products_product p JOIN products_category c ON c.id = p.category_id")
+CREATE_INDEX_SQL = {
+    'sqlite': [
+        "DROP TABLE IF EXISTS products_product_fts",
+        "CREATE VIRTUAL TABLE products_product_fts USING fts5("
+        "title, description, category, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        "DROP TABLE IF EXISTS products_product_search",
+        "CREATE TABLE products_product_search ("
+        "product_id bigint PRIMARY KEY REFERENCES products_product(id) "
+        "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        "CREATE INDEX products_product_search_document_gin "
+        "ON products_product_search USING GIN (document)",
+    ],
+}
+INSERT_DOCUMENTS_SQL = {
+    'sqlite': (
+        "INSERT OR REPLACE INTO products_product_fts(rowid, title, description, category) "
+        "VALUES (%s, %s, %s, %s)"),
+    'postgresql': (
+        "INSERT INTO products_product_search(product_id, document) "
+        "VALUES (%s, "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'C')) "
+        "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document"),
+}
+
+
+def normalize_document(text):
+    text = unicodedata.normalize('NFKC', text or '').translate(CHARACTER_MAP)
+    text = IGNORED_RE.sub('', text).lower()
+    parts = [part for word in COMPOUND_RE.findall(text) for part in word.split(ZWNJ)]
+    return ' '.join([text.replace(ZWNJ, ''), *parts])
+
+
+def rebuild_search_index(apps, schema_editor):
+    # documents are now stored in normalized form
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_INDEX_SQL:
+        return
+    for statement in CREATE_INDEX_SQL[vendor]:
+        schema_editor.execute(statement)
+
+    with schema_editor.connection.cursor() as source, schema_editor.connection.cursor() as cursor:
+        source.execute(DOCUMENTS_SQL)
+        while rows := source.fetchmany(2000):
+            documents = [
+                (product_id, normalize_document(title), normalize_document(description),
+                 normalize_document(category))
+                for product_id, title, description, category in rows]
+            if vendor == 'postgresql':
+                # weighted title, category, description
+                documents = [(product_id, title, category, description)
+                             for product_id, title, description, category in documents]
+            cursor.executemany(INSERT_DOCUMENTS_SQL[vendor], documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1 on 2026-10-18 03:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def baseline_sold(apps, schema_editor):
+    # past sales have no dates, so only sales after this migration count as trending
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(trending_sold=F('sold'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_category_active_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField()),
+                ('last_view_id', models.BigIntegerField(default=0)),
+                ('last_rating_id', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending_sold',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-trending_score', '-id'], name='product_trending_idx'),
+        ),
+        migrations.RunPython(baseline_sold, migrations.RunPython.noop),
+    ]
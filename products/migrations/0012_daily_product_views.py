@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 03:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_trending_score'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField()),
+                ('viewers', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mostviewed',
+            index=models.Index(fields=['created'], name='mostviewed_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailyproductviews',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='products.product'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyproductviews',
+            index=models.Index(fields=['product', 'day'], name='daily_product_views_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductviews',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='unique_daily_product_views'),
+        ),
+    ]
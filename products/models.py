@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
@@ -10,7 +10,7 @@ from mptt.models import MPTTModel, TreeForeignKey
 
 
 class IpAddress(models.Model):
-    ip_address = models.GenericIPAddressField(verbose_name='آدرس آیپی')
+    ip_address = models.GenericIPAddressField(verbose_name='آدرس آیپی', db_index=True)
 
 
 class CategoryManager(models.Manager):
@@ -56,6 +56,7 @@ class ProductGallery(models.Model):
         options={'quality': 90},
         null=True,
         blank=True,)
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name = _("Gallery")
@@ -96,8 +97,15 @@ class Product(models.Model):
     updated = models.DateTimeField(auto_now=True,)
     active = models.BooleanField(default=False)
     poster = models.ImageField(upload_to='poster/',)
+    poster_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     view_count = models.ManyToManyField(
         IpAddress, through='MostViewed', blank=True, related_name='hits', verbose_name='بازدیدها')
+    views_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='تعداد بازدید')
+    # time-decayed popularity, maintained by `update_trending_scores`
+    trending_score = models.FloatField(default=0, editable=False)
+    # `sold` when the trending score last counted sales
+    trending_sold = models.IntegerField(default=0, editable=False)
     # promotion = models.ForeignKey("promotion.Promotion", verbose_name=_(
     #     "promotion"), on_delete=models.CASCADE)
     # loved =
@@ -107,6 +115,14 @@ class Product(models.Model):
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['-views_count', '-id'], name='product_views_count_idx'),
+            models.Index(fields=['-created', '-id'], name='product_created_idx'),
+            models.Index(fields=['-sold', '-id'], name='product_sold_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'active'], name='product_category_active_idx'),
+            models.Index(fields=['-trending_score', '-id'], name='product_trending_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -120,3 +136,107 @@ class MostViewed(models.Model):
     user = models.ForeignKey("accounts.CustomUser", on_delete=models.CASCADE)
     ip = models.ForeignKey(IpAddress,  on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created'], name='mostviewed_created_idx'),
+        ]
+
+
+class ProductViewerManager(models.Manager):
+    def increment(self, product_id, user_id, count=1):
+        """Add `count` views of `user_id` to the rollup row, creating it if needed."""
+        updated = self.filter(product_id=product_id, user_id=user_id) \
+            .update(view_count=models.F('view_count') + count)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                self.create(product_id=product_id, user_id=user_id, view_count=count)
+        except IntegrityError:
+            # created concurrently, fall back to the atomic increment
+            self.filter(product_id=product_id, user_id=user_id) \
+                .update(view_count=models.F('view_count') + count)
+
+    def increment_many(self, counts):
+        """Add `{(product_id, user_id): count}` views to the rollup with a few queries per batch."""
+        counts = list(counts.items())
+        for start in range(0, len(counts), 500):
+            batch = dict(counts[start:start + 500])
+            existing = {
+                (product_id, user_id): row_id
+                for row_id, product_id, user_id in self.filter(
+                    product_id__in={product_id for product_id, _ in batch},
+                    user_id__in={user_id for _, user_id in batch}).values_list('id', 'product_id', 'user_id')
+                if (product_id, user_id) in batch
+            }
+            if existing:
+                added = models.Case(
+                    *(models.When(id=row_id, then=models.Value(batch[pair])) for pair, row_id in existing.items()),
+                    output_field=models.IntegerField())
+                self.filter(id__in=existing.values()).update(view_count=models.F('view_count') + added)
+            missing = [pair for pair in batch if pair not in existing]
+            try:
+                with transaction.atomic():
+                    self.bulk_create([
+                        self.model(product_id=product_id, user_id=user_id, view_count=batch[product_id, user_id])
+                        for product_id, user_id in missing])
+            except IntegrityError:
+                for product_id, user_id in missing:
+                    self.increment(product_id, user_id, batch[product_id, user_id])
+
+
+class ProductViewer(models.Model):
+    """Per (product, user) rollup of MostViewed rows."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='viewers')
+    user = models.ForeignKey("accounts.CustomUser", on_delete=models.CASCADE)
+    view_count = models.PositiveIntegerField(default=0)
+
+    objects = ProductViewerManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_product_viewer'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-view_count'], name='product_top_viewers_idx'),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """Top co-viewed products of a product, rebuilt by `rebuild_related_products`."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_product_rank'),
+        ]
+
+
+class DailyProductViews(models.Model):
+    """Views of a product on one day, folded from old `MostViewed` rows by `compact_product_views`."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views')
+    day = models.DateField()
+    views = models.PositiveIntegerField()
+    # distinct users
+    viewers = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_views'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='daily_product_views_idx'),
+        ]
+
+
+class TrendingState(models.Model):
+    """Progress of `update_trending_scores`, a single row."""
+    # scores are in units of weight at this time, see products.trending
+    epoch = models.DateTimeField()
+    last_view_id = models.BigIntegerField(default=0)
+    last_rating_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
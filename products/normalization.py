@@ -0,0 +1,55 @@
+import re
+import unicodedata
+
+# Arabic code points that Persian text spells with its own letters
+CHARACTER_MAP = str.maketrans({
+    'ي': 'ی',  # arabic yeh
+    'ى': 'ی',  # alef maksura
+    'ك': 'ک',  # arabic kaf
+    'ة': 'ه',  # teh marbuta
+    'ۀ': 'ه',  # heh with yeh above
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    **{digit: str(value) for value, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{digit: str(value) for value, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+# harakat, superscript alef, tatweel and the zero-width characters but the non-joiner
+IGNORED_RE = re.compile(r'[\u064b-\u065f\u0670\u0640\u200b\u200d-\u200f\ufeff]')
+TERM_RE = re.compile(r'\w+')
+# zero-width non-joiner between the parts of one word, as in 'می‌خواهم'
+ZWNJ = '\u200c'
+COMPOUND_RE = re.compile(r'\w+(?:\u200c\w+)+')
+
+
+def fold(text):
+    text = unicodedata.normalize('NFKC', text or '').translate(CHARACTER_MAP)
+    return IGNORED_RE.sub('', text).lower()
+
+
+def normalize_text(text):
+    """
+    Fold spelling variants of Persian/Arabic text into one form.
+
+    Presentation forms are unfolded (NFKC), Arabic yeh/kaf become their
+    Persian letters, Persian and Arabic digits become ascii, diacritics
+    and tatweel are dropped and zero-width non-joiners are removed, so
+    'می‌خواهم' and 'میخواهم' are the same word.
+    """
+    return fold(text).replace(ZWNJ, '')
+
+
+def normalize_document(text):
+    """
+    `normalize_text` for indexing, followed by the parts of every word
+    joined with a non-joiner, so the spelling 'می خواهم' matches it too.
+    """
+    text = fold(text)
+    parts = [part for word in COMPOUND_RE.findall(text) for part in word.split(ZWNJ)]
+    return ' '.join([text.replace(ZWNJ, ''), *parts])
+
+
+def tokenize(text):
+    """Split text into normalized word terms."""
+    return TERM_RE.findall(normalize_text(text))
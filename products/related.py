@@ -0,0 +1,101 @@
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .models import ProductViewer, RelatedProduct
+from .response_cache import response_cache
+
+
+class CoViewMatrix:
+    """
+    Binary user x product matrix of who viewed what.
+
+    Built from the `ProductViewer` rollup, which already holds one row per
+    (product, user) out of all `MostViewed` rows. Item-item cosine
+    similarity is computed one block of products at a time as
+    `X[:, block].T @ X`, so only a block's co-occurrence rows are ever in
+    memory.
+    """
+
+    def __init__(self, matrix, product_ids):
+        self.matrix = matrix.tocsc()
+        self.product_ids = product_ids
+        # sqrt of the number of viewers per product, the column norms of a binary matrix
+        self.norms = np.sqrt(np.asarray(self.matrix.sum(axis=0)).ravel())
+
+    @classmethod
+    def from_database(cls, chunk_size=100000, max_user_items=500):
+        """
+        Load viewer rows in chunks into flat arrays.
+
+        Users who viewed more than `max_user_items` products (crawlers,
+        mostly) are dropped: they relate everything to everything and
+        their pairs grow quadratically.
+        """
+        # one statement, so rows changed during the load cannot make the arrays inconsistent
+        rows = ProductViewer.objects.filter(view_count__gt=0).order_by() \
+            .values_list('user_id', 'product_id').iterator(chunk_size=chunk_size)
+        pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int64)
+        users, products = pairs[0::2], pairs[1::2]
+
+        user_ids, user_rows = np.unique(users, return_inverse=True)
+        product_ids, product_columns = np.unique(products, return_inverse=True)
+        keep = np.bincount(user_rows, minlength=len(user_ids))[user_rows] <= max_user_items
+
+        matrix = sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.float32), (user_rows[keep], product_columns[keep])),
+            shape=(len(user_ids), len(product_ids)))
+        return cls(matrix, product_ids)
+
+    def top_related(self, start, stop, top_n=10, min_common=2):
+        """
+        Yield `(product_id, [(related_id, score), ...])` for columns `start:stop`.
+
+        Pairs seen together by fewer than `min_common` users are ignored.
+        """
+        block = self.matrix[:, start:stop]
+        co_views = (block.T @ self.matrix).tocsr()
+        co_views.setdiag(0, k=start)
+        co_views.data[co_views.data < min_common] = 0
+        co_views.eliminate_zeros()
+
+        for row in range(co_views.shape[0]):
+            lo, hi = co_views.indptr[row], co_views.indptr[row + 1]
+            if lo == hi:
+                continue
+            columns = co_views.indices[lo:hi]
+            scores = co_views.data[lo:hi] / (self.norms[start + row] * self.norms[columns])
+            top = np.argsort(-scores, kind='stable')[:top_n]
+            yield int(self.product_ids[start + row]), [
+                (int(self.product_ids[columns[i]]), float(scores[i])) for i in top]
+
+    def save(self, top_n=10, min_common=2, block_size=2000):
+        """
+        Replace the stored related products, one block of product ids per transaction.
+
+        Each block owns the id range up to the next block's first id, so
+        stale rows of products that lost all their co-views go too.
+        """
+        saved = 0
+        n_products = len(self.product_ids)
+        for start in range(0, max(n_products, 1), block_size):
+            stop = min(start + block_size, n_products)
+            rows = [
+                RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=score)
+                for product_id, related in self.top_related(start, stop, top_n, min_common)
+                for rank, (related_id, score) in enumerate(related)
+            ]
+            stale = RelatedProduct.objects.all()
+            if start:
+                stale = stale.filter(product_id__gte=int(self.product_ids[start]))
+            if stop < n_products:
+                stale = stale.filter(product_id__lt=int(self.product_ids[stop]))
+            with transaction.atomic():
+                stale.delete()
+                RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+            saved += len(rows)
+
+        response_cache.invalidate('related-products')
+        return saved
@@ -0,0 +1,198 @@
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from zibanoo.db_router import read_from_primary
+
+from .utils import get_query_params_key
+
+
+class ResponseCache:
+    """
+    Cache of API response data keyed by path and normalized query params.
+
+    Every entry records the version of each of its tags when it was stored;
+    invalidating a tag sets a new version, so stale entries are skipped on
+    the next read without having to know their keys. Versions are the
+    time of the change in nanoseconds, which tells `read_from_primary`
+    whether the replicas have caught up with it. The cache backend must be
+    shared by all processes for invalidations to reach them.
+
+    Hit/miss counters are summed in process and added to the shared
+    counters at most every `stats_interval` seconds.
+    """
+
+    def __init__(self, alias='default', timeout=300, stats_interval=10):
+        self.alias = alias
+        self.timeout = timeout
+        self.stats_interval = stats_interval
+        self._counts = Counter()
+        self._counts_saved = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_key(self, request):
+        path_key = md5(request.path.encode()).hexdigest()
+        return f'response_{path_key}_{get_query_params_key(request.query_params)}'
+
+    def get_tag_versions(self, tags):
+        keys = {f'response_tag_{tag}': tag for tag in tags}
+        versions = self.cache.get_many(keys)
+        missing = {key: time.time_ns() for key in keys if key not in versions}
+        for key, version in missing.items():
+            self.cache.add(key, version, None)
+        versions.update(self.cache.get_many(missing))
+        return {keys[key]: version for key, version in versions.items()}
+
+    def get(self, key, tag_versions):
+        entry = self.cache.get(key)
+        if entry is not None and entry['tags'] == tag_versions:
+            self.count('hits')
+            return entry
+        self.count('misses')
+        return None
+
+    def set(self, key, data, status_code, tag_versions, etag=None, last_modified=None):
+        self.cache.set(key, {
+            'data': data,
+            'status': status_code,
+            'tags': tag_versions,
+            'etag': etag,
+            'last_modified': last_modified,
+        }, self.timeout)
+
+    def invalidate(self, *tags):
+        # concurrent invalidations may overwrite each other, any new version will do
+        version = time.time_ns()
+        self.cache.set_many({f'response_tag_{tag}': version for tag in tags}, None)
+
+    @staticmethod
+    def get_changed(tag_versions):
+        """Time of the newest change of the tags, in seconds."""
+        return max(tag_versions.values(), default=0) / 1e9
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+            now = time.monotonic()
+            if now - self._counts_saved < self.stats_interval:
+                return
+            counts, self._counts, self._counts_saved = self._counts, Counter(), now
+        self.save_counts(counts)
+
+    def save_counts(self, counts=None):
+        if counts is None:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+        for name, value in counts.items():
+            try:
+                self.cache.incr(f'response_cache_{name}', value)
+            except ValueError:
+                self.cache.add(f'response_cache_{name}', value, None)
+
+    def get_stats(self):
+        stats = self.cache.get_many(['response_cache_hits', 'response_cache_misses'])
+        hits = stats.get('response_cache_hits', 0)
+        misses = stats.get('response_cache_misses', 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 3) if total else 0,
+        }
+
+    def reset_stats(self):
+        self.cache.delete_many(['response_cache_hits', 'response_cache_misses'])
+
+    def _save_counts_at_exit(self):
+        try:
+            self.save_counts()
+        except Exception:
+            # the counts are statistics only, and the cache may be gone already
+            pass
+
+    def _reset_after_fork(self):
+        # counts of the parent stay with the parent
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+
+response_cache = ResponseCache(
+    alias=getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default'),
+    timeout=getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300),
+    stats_interval=getattr(settings, 'RESPONSE_CACHE_STATS_INTERVAL', 10),
+)
+atexit.register(response_cache._save_counts_at_exit)
+os.register_at_fork(after_in_child=response_cache._reset_after_fork)
+
+
+def get_validators(view, request, *args, **kwargs):
+    """Return `(etag, last_modified timestamp)` from the view's optional `get_validators`."""
+    if not hasattr(view, 'get_validators'):
+        return None, None
+    etag, last_modified = view.get_validators(request, *args, **kwargs)
+    if etag is not None:
+        etag = quote_etag(md5(f'{request.get_full_path()}:{etag}'.encode()).hexdigest())
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    return etag, last_modified
+
+
+def cache_response(method):
+    """
+    Cache successful responses of a view's `get` method.
+
+    The view's `get_cache_tags(request, *args, **kwargs)` returns the tags
+    the response depends on. Their versions are read before the view runs,
+    so a change made while the response is being built is never cached as
+    current.
+
+    Views may also define `get_validators(request, *args, **kwargs)`
+    returning `(etag, last_modified)`; conditional requests are then
+    answered with 304 before the response is built. Validators are stored
+    with the cached entry, so a cache hit checks them without a query.
+    A miss reads from the primary until the replicas have caught up with
+    the newest tag version, so a lagging replica is never cached.
+    """
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = response_cache.get_key(request)
+        tag_versions = response_cache.get_tag_versions(view.get_cache_tags(request, *args, **kwargs))
+        entry = response_cache.get(key, tag_versions)
+        if entry is not None:
+            etag, last_modified = entry['etag'], entry['last_modified']
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = Response(entry['data'], status=entry['status'])
+        else:
+            # validators and data from the same database
+            with read_from_primary(response_cache.get_changed(tag_versions)):
+                etag, last_modified = get_validators(view, request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = method(view, request, *args, **kwargs)
+                    if response.status_code == 200:
+                        response_cache.set(key, response.data, response.status_code, tag_versions,
+                                           etag, last_modified)
+
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        response['X-Cache'] = 'HIT' if entry is not None else 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,242 @@
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+from .normalization import normalize_document, tokenize
+
+DOCUMENTS_SQL = (
+    "SELECT p.id, p.title, p.description, c.name "
+    "FROM products_product p JOIN products_category c ON c.id = p.category_id")
+
+
+def get_search_terms(query):
+    """Split a raw search query into normalized word terms."""
+    return tokenize(query)
+
+
+def normalize_documents(rows):
+    return [(product_id, normalize_document(title), normalize_document(description), normalize_document(category))
+            for product_id, title, description, category in rows]
+
+
+class SearchBackend:
+    """
+    Full-text index over product title, description and category name.
+
+    Subclasses keep the index in a vendor specific side table; this base
+    class falls back to the original `icontains` scan so unsupported
+    databases keep working.
+    """
+    vendor = None
+
+    def create_index(self, cursor):
+        pass
+
+    def drop_index(self, cursor):
+        pass
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def filter_queryset(self, queryset, query):
+        terms = get_search_terms(query)
+        if not terms:
+            return queryset.none()
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(description__icontains=term)
+        return queryset.filter(condition)
+
+    def annotate_rank(self, queryset, query):
+        """Annotate the matches of an already filtered queryset with `search_rank`, higher is better."""
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    def search(self, query, limit=None):
+        """Return `(product_id, score)` pairs, best match first."""
+        products = self.filter_queryset(Product.objects.all(), query) \
+            .values_list('id', flat=True)
+        if limit:
+            products = products[:limit]
+        return [(product_id, 0.0) for product_id in products]
+
+
+
+class DocumentSearchBackend(SearchBackend):
+    """
+    Base for side tables of normalized product documents.
+
+    Text is normalized once when a product is indexed, so spelling
+    variants match without normalizing any rows at query time.
+    """
+    chunk_size = 2000
+
+    def populate_index(self, cursor):
+        """Write the normalized documents of every product in chunks."""
+        with cursor.db.cursor() as source:
+            source.execute(DOCUMENTS_SQL)
+            while rows := source.fetchmany(self.chunk_size):
+                self.write_documents(cursor, normalize_documents(rows))
+
+    def write_documents(self, cursor, documents):
+        raise NotImplementedError
+
+    def index_products(self, product_ids):
+        documents = self.get_documents(product_ids)
+        if documents:
+            with connection.cursor() as cursor:
+                self.write_documents(cursor, documents)
+
+    def get_documents(self, product_ids):
+        return normalize_documents(
+            Product.objects.filter(id__in=product_ids)
+            .values_list('id', 'title', 'description', 'category__name'))
+
+
+class SQLiteSearchBackend(DocumentSearchBackend):
+    """FTS5 virtual table keyed by product id, ranked with bm25()."""
+    vendor = 'sqlite'
+    table = 'products_product_fts'
+    # column weights for bm25(): title, description, category
+    weights = (10.0, 1.0, 4.0)
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            "title, description, category, "
+            "tokenize = 'unicode61 remove_diacritics 2')")
+        self.populate_index(cursor)
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def write_documents(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {self.table}(rowid, title, description, category) "
+            "VALUES (%s, %s, %s, %s)", documents)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE rowid = %s",
+                [(product_id,) for product_id in product_ids])
+
+    def get_match_expression(self, query):
+        terms = get_search_terms(query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def filter_queryset(self, queryset, query):
+        expression = self.get_match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s",
+            [expression]))
+
+    def annotate_rank(self, queryset, query):
+        # a rowid lookup in the index per match, not a scan
+        return queryset.annotate(search_rank=RawSQL(
+            f"SELECT -bm25({self.table}, %s, %s, %s) FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND rowid = products_product.id",
+            [*self.weights, self.get_match_expression(query)], output_field=FloatField()))
+
+    def search(self, query, limit=None):
+        expression = self.get_match_expression(query)
+        if not expression:
+            return []
+        sql = (f"SELECT rowid, -bm25({self.table}, %s, %s, %s) AS score "
+               f"FROM {self.table} WHERE {self.table} MATCH %s ORDER BY score DESC")
+        params = [*self.weights, expression]
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class PostgresSearchBackend(DocumentSearchBackend):
+    """tsvector side table with a GIN index, ranked with ts_rank_cd()."""
+    vendor = 'postgresql'
+    table = 'products_product_search'
+    config = 'simple'
+    document_sql = (
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'C')")
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "product_id bigint PRIMARY KEY REFERENCES products_product(id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin "
+            f"ON {self.table} USING GIN (document)")
+        self.populate_index(cursor)
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def write_documents(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {self.table}(product_id, document) "
+            f"VALUES (%s, {self.document_sql}) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            [(product_id, title, category, description)
+             for product_id, title, description, category in documents])
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE product_id = ANY(%s)",
+                [list(product_ids)])
+
+    def get_tsquery(self, query):
+        terms = get_search_terms(query)
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def filter_queryset(self, queryset, query):
+        tsquery = self.get_tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT product_id FROM {self.table} "
+            f"WHERE document @@ to_tsquery('{self.config}', %s)",
+            [tsquery]))
+
+    def annotate_rank(self, queryset, query):
+        return queryset.annotate(search_rank=RawSQL(
+            f"SELECT ts_rank_cd(document, to_tsquery('{self.config}', %s)) FROM {self.table} "
+            "WHERE product_id = products_product.id",
+            [self.get_tsquery(query)], output_field=FloatField()))
+
+    def search(self, query, limit=None):
+        tsquery = self.get_tsquery(query)
+        if not tsquery:
+            return []
+        sql = (f"SELECT product_id, ts_rank_cd(document, q) AS score "
+               f"FROM {self.table}, to_tsquery('{self.config}', %s) q "
+               "WHERE document @@ q ORDER BY score DESC")
+        params = [tsquery]
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+SEARCH_BACKENDS = {
+    backend.vendor: backend
+    for backend in (SQLiteSearchBackend, PostgresSearchBackend)
+}
+
+
+def get_search_backend(vendor=None):
+    """Return the search backend matching the database vendor."""
+    return SEARCH_BACKENDS.get(vendor or connection.vendor, SearchBackend)()
@@ -1,6 +1,10 @@
-from django.db.models import Count
-from rest_framework import serializers
-from .models import IpAddress, Category, ProductGallery, Product, MostViewed
+from operator import itemgetter
+
+from django.core.files.storage import default_storage
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .images import get_srcset
+from .models import IpAddress, Category, ProductGallery, Product, ProductViewer, RelatedProduct
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -17,28 +21,54 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ProductGallerySerializer(serializers.ModelSerializer):
     """serializer for ProductGallery"""
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductGallery
-        fields = ['id', 'product', 'resizes_images']
+        fields = ['id', 'product', 'resizes_images', 'srcset']
+
+    def get_srcset(self, obj):
+        return get_srcset(obj.derivatives)
+
+
+class ProductGalleryRowSerializer:
+    """`.values()` twin of `ProductGallerySerializer`, like `ProductListSerializer`."""
+    columns = ['id', 'product_id', 'resizes_images', 'derivatives']
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'product': row['product_id'],
+            'resizes_images': default_storage.url(row['resizes_images']) if row['resizes_images'] else None,
+            'srcset': get_srcset(row['derivatives']),
+        }
 
 
 class ProductSerializer(serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
     images = serializers.SerializerMethodField()
+    images_srcset = serializers.SerializerMethodField()
+    poster_srcset = serializers.SerializerMethodField()
+    view_count = serializers.IntegerField(source='views_count', read_only=True)
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'slug', 'color', 'size', 'price', 'stock', 'sold',
                   'description', 'category', 'created', 'updated', 'active',
-                  'poster', 'view_count', 'images']
+                  'poster', 'poster_srcset', 'view_count', 'images', 'images_srcset']
         read_only_fields = ['created', 'updated', 'sold', 'view_count']
 
     def get_images(self, obj):
-        product_galleries = ProductGallery.objects.filter(product=obj)
+        # uses the prefetched galleries when the view provided them
+        product_galleries = obj.productgallery_set.all()
         return [gallery.original_images.url for gallery in product_galleries if gallery.resizes_images]
-     
-    def get_view_count(self, obj):
-        return MostViewed.objects.filter(product=obj).count()
+
+    def get_images_srcset(self, obj):
+        return [get_srcset(gallery.derivatives) for gallery in obj.productgallery_set.all()
+                if gallery.resizes_images]
+
+    def get_poster_srcset(self, obj):
+        return get_srcset(obj.poster_derivatives)
 
     def validate_price(self, value):
         if value < 0:
@@ -51,21 +81,101 @@ class ProductSerializer(serializers.ModelSerializer):
         return value
 
 
+class ProductListSerializer:
+    """
+    Read-only, instance-free twin of `ProductSerializer` for listings.
+
+    Takes the rows of `queryset.values(*columns)` and loads the galleries of
+    a whole page with one `values_list` query. Every output field is an
+    accessor compiled once per serializer, so no model instances or DRF
+    fields are built per product, and the output is the same as
+    `ProductSerializer(page, many=True).data` key for key.
+    """
+    columns = ['id', 'title', 'slug', 'color', 'size', 'price', 'stock', 'sold',
+               'description', 'category_id', 'created', 'updated', 'active',
+               'poster', 'poster_derivatives', 'views_count',
+               # read by the cursor paginator, not rendered
+               'trending_score']
+    # depend on the page's galleries or timezone
+    page_fields = ('created', 'updated', 'images', 'images_srcset')
+
+    def __init__(self):
+        self.datetime_field = ProductSerializer().fields['created']
+        accessors = {name: itemgetter(name) for name in self.columns}
+        accessors.update({
+            'category': itemgetter('category_id'),
+            'poster': lambda row: default_storage.url(row['poster']) if row['poster'] else None,
+            'poster_srcset': lambda row: get_srcset(row['poster_derivatives']),
+            'view_count': itemgetter('views_count'),
+        })
+        # the page's accessors are filled in by get_accessors()
+        self.accessors = [(name, None if name in self.page_fields else accessors[name])
+                          for name in ProductSerializer.Meta.fields]
+
+    def get_galleries(self, product_ids):
+        galleries = {product_id: [] for product_id in product_ids}
+        rows = ProductGallery.objects.filter(product_id__in=product_ids).exclude(resizes_images='') \
+            .exclude(resizes_images=None).order_by('id') \
+            .values_list('product_id', 'original_images', 'derivatives')
+        for product_id, image, derivatives in rows:
+            galleries[product_id].append((image, derivatives))
+        return galleries
+
+    def get_datetime_formatter(self):
+        field_timezone = self.datetime_field.default_timezone()
+        if field_timezone is None or api_settings.DATETIME_FORMAT.lower() != ISO_8601:
+            return self.datetime_field.to_representation
+
+        # DateTimeField.to_representation with the timezone looked up once per page
+        def to_datetime(value):
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return to_datetime
+
+    def get_accessors(self, galleries):
+        """Complete the accessors with the page's galleries; rows are left as fetched."""
+        to_datetime = self.get_datetime_formatter()
+        page_accessors = {
+            'created': lambda row: to_datetime(row['created']),
+            'updated': lambda row: to_datetime(row['updated']),
+            'images': lambda row: [default_storage.url(image) for image, _ in galleries[row['id']]],
+            'images_srcset': lambda row: [get_srcset(derivatives) for _, derivatives in galleries[row['id']]],
+        }
+        return [(name, accessor or page_accessors[name]) for name, accessor in self.accessors]
+
+    def to_representation(self, rows):
+        accessors = self.get_accessors(self.get_galleries([row['id'] for row in rows]))
+        return [{name: accessor(row) for name, accessor in accessors} for row in rows]
+
+
 class ProductDetailSerializer(ProductSerializer):
     """product serialaaizer for single page"""
 
     most_viewed = serializers.SerializerMethodField()
+    related_products = serializers.SerializerMethodField()
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ['most_viewed']
+        fields = ProductSerializer.Meta.fields + ['most_viewed', 'related_products']
 
     def get_most_viewed(self, obj):
-        most_viewed = MostViewed.objects.filter(product=obj) \
-            .values('user') \
-            .annotate(view_count=Count('id')) \
-            .order_by('-view_count')[:5]
+        # served from the (product, -view_count) index of the rollup table
+        most_viewed = ProductViewer.objects.filter(product=obj, view_count__gt=0) \
+            .order_by('-view_count') \
+            .values('user', 'view_count')[:5]
         return [{'user_id': item['user'], 'view_count': item['view_count']} for item in most_viewed]
 
+    def get_related_products(self, obj):
+        # precomputed by rebuild_related_products, read through the (product, rank) index
+        related = RelatedProduct.objects.filter(product=obj, related__active=True) \
+            .order_by('rank') \
+            .values('related_id', 'related__title', 'related__slug', 'related__poster')
+        return [{
+            'id': item['related_id'],
+            'title': item['related__title'],
+            'slug': item['related__slug'],
+            'poster': default_storage.url(item['related__poster']) if item['related__poster'] else None,
+        } for item in related]
+
 
 # search vectore for products
 class ProductSearchSerializer(serializers.ModelSerializer):
@@ -0,0 +1,152 @@
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.db import transaction
+from django.utils import timezone
+from mptt.signals import node_moved
+
+from .models import Category, Product, ProductGallery, ProductViewer, MostViewed
+from .utils import invalidate_category_tree, bump_catalog_version
+from .search import get_search_backend
+from .similarity import similarity_engine
+from .response_cache import response_cache
+from .images import derivative_pipeline, derivatives_ready
+from .autocomplete import autocomplete
+
+
+# Keep Product.views_count and the ProductViewer rollup in step with MostViewed rows
+@receiver(post_save, sender=MostViewed)
+def increment_views_count(sender, instance, created, **kwargs):
+    if created:
+        Product.objects.filter(pk=instance.product_id) \
+            .update(views_count=F('views_count') + 1)
+        ProductViewer.objects.increment(instance.product_id, instance.user_id)
+
+
+@receiver(post_delete, sender=MostViewed)
+def decrement_views_count(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id, views_count__gt=0) \
+        .update(views_count=F('views_count') - 1)
+    ProductViewer.objects.filter(product_id=instance.product_id, user_id=instance.user_id, view_count__gt=0) \
+        .update(view_count=F('view_count') - 1)
+
+
+# Drop the cached category tree whenever the tree changes
+@receiver([post_save, post_delete, node_moved], sender=Category)
+def clear_category_tree_cache(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+
+# Keep the full-text search index in sync with products and category names
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index_products([instance.pk])
+    similarity_engine.update_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+    similarity_engine.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        product_ids = list(instance.product_set.values_list('id', flat=True))
+        backend = get_search_backend()
+        for start in range(0, len(product_ids), 500):
+            backend.index_products(product_ids[start:start + 500])
+
+
+# Cached catalog aggregates (facets, counts) are keyed by the catalog version
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def bump_catalog(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+# Evict only the cached API responses that depend on the changed rows
+@receiver(pre_save, sender=Product)
+def remember_product_slug(sender, instance, **kwargs):
+    # a renamed product must also evict the responses cached under its old slug
+    instance._previous_slug = Product.objects.filter(pk=instance.pk).values_list('slug', flat=True).first() \
+        if instance.pk else None
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_previous_slug', None)} - {None}
+    response_cache.invalidate('product-list', *(f'product:{slug}' for slug in slugs))
+
+
+@receiver([post_save, post_delete], sender=ProductGallery)
+def invalidate_gallery_responses(sender, instance, **kwargs):
+    slug = Product.objects.filter(pk=instance.product_id).values_list('slug', flat=True).first()
+    response_cache.invalidate(
+        'product-list', f'product:{slug}',
+        'product-galleries', f'product-galleries:{instance.product_id}')
+
+
+@receiver([post_save, post_delete, node_moved], sender=Category)
+def invalidate_category_responses(sender, instance, **kwargs):
+    response_cache.invalidate('categories', 'product-list')
+
+
+# Gallery changes are part of the product detail, so they bump Product.updated
+@receiver([post_save, post_delete], sender=ProductGallery)
+def touch_gallery_product(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(updated=timezone.now())
+
+
+# Resize uploads in the background once the upload is committed
+@receiver(post_save, sender=Product)
+def queue_poster_derivatives(sender, instance, **kwargs):
+    if instance.poster and instance.poster.name != instance.poster_derivatives.get('source'):
+        transaction.on_commit(lambda: derivative_pipeline.submit(
+            Product, instance.pk, 'poster', 'poster_derivatives'))
+
+
+@receiver(post_save, sender=ProductGallery)
+def queue_gallery_derivatives(sender, instance, **kwargs):
+    if instance.original_images and instance.original_images.name != instance.derivatives.get('source'):
+        transaction.on_commit(lambda: derivative_pipeline.submit(
+            ProductGallery, instance.pk, 'original_images', 'derivatives',
+            fill=(300, 400), fill_field='resizes_images'))
+
+
+# Stored derivatives change the serialized srcset, like any other edit
+@receiver(derivatives_ready, sender=Product)
+def poster_derivatives_ready(sender, pk, **kwargs):
+    slug = Product.objects.filter(pk=pk).values_list('slug', flat=True).first()
+    Product.objects.filter(pk=pk).update(updated=timezone.now())
+    response_cache.invalidate('product-list', f'product:{slug}')
+
+
+@receiver(derivatives_ready, sender=ProductGallery)
+def gallery_derivatives_ready(sender, pk, **kwargs):
+    gallery = ProductGallery.objects.filter(pk=pk).only('product_id').first()
+    if gallery is not None:
+        touch_gallery_product(sender, gallery)
+        invalidate_gallery_responses(sender, gallery)
+
+
+# Keep the in-memory autocomplete index current
+@receiver(post_save, sender=Product)
+def update_product_suggestions(sender, instance, **kwargs):
+    autocomplete.update_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_suggestions(sender, instance, **kwargs):
+    autocomplete.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def update_category_suggestions(sender, instance, **kwargs):
+    autocomplete.update_category(instance)
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_suggestions(sender, instance, **kwargs):
+    autocomplete.remove_category(instance.pk)
@@ -0,0 +1,263 @@
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+from .models import Product
+from .search import get_search_terms
+from .utils import ChangeFeed
+
+
+def get_index_dir():
+    return getattr(settings, 'PRODUCT_SIMILARITY_INDEX_DIR',
+                   os.path.join(settings.BASE_DIR, 'search_index', 'similarity'))
+
+
+def get_product_text(title, description, category):
+    return f"{title} {description} {category or ''}"
+
+
+class TfidfMatrix:
+    """
+    Term-major (CSC) TF-IDF matrix of product texts.
+
+    Row `i` of the matrix is the product `product_ids[i]`; for each term the
+    postings live in `doc_indices[indptr[t]:indptr[t + 1]]` with l2
+    normalized weights in `weights`, so a query only touches the postings
+    of its own terms.
+    """
+    arrays = ('indptr', 'doc_indices', 'weights', 'idf', 'product_ids', 'category_ids')
+
+    def __init__(self, vocabulary, indptr, doc_indices, weights, idf, product_ids, category_ids,
+                 changes=None):
+        # position of the change feed the matrix was built at
+        self.changes = changes
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_indices = doc_indices
+        self.weights = weights
+        self.idf = idf
+        self.product_ids = product_ids
+        self.category_ids = category_ids
+
+    @classmethod
+    def build(cls, documents):
+        """Build the matrix from `(product_id, category_id, text)` tuples sorted by product id."""
+        vocabulary = {}
+        product_ids, category_ids = [], []
+        doc_column, term_column, tf_column = [], [], []
+
+        for row, (product_id, category_id, text) in enumerate(documents):
+            product_ids.append(product_id)
+            category_ids.append(category_id or 0)
+            for term, count in Counter(get_search_terms(text)).items():
+                doc_column.append(row)
+                term_column.append(vocabulary.setdefault(term, len(vocabulary)))
+                tf_column.append(count)
+
+        n_docs, n_terms = len(product_ids), len(vocabulary)
+        doc_column = np.asarray(doc_column, dtype=np.int32)
+        term_column = np.asarray(term_column, dtype=np.int32)
+        tf_column = np.asarray(tf_column, dtype=np.float32)
+
+        df = np.bincount(term_column, minlength=n_terms)
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        weights = (1 + np.log(tf_column)) * idf[term_column]
+        norms = np.sqrt(np.bincount(doc_column, weights=weights ** 2, minlength=n_docs))
+        weights = (weights / np.maximum(norms[doc_column], 1e-12)).astype(np.float32)
+
+        order = np.argsort(term_column, kind='stable')
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        return cls(
+            vocabulary=vocabulary,
+            indptr=indptr,
+            doc_indices=doc_column[order],
+            weights=weights[order],
+            idf=idf,
+            product_ids=np.asarray(product_ids, dtype=np.int64),
+            category_ids=np.asarray(category_ids, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_database(cls, chunk_size=2000):
+        # changes published while the rows are read are applied again
+        changes = similarity_changes.get_position()
+        rows = Product.objects.order_by('id') \
+            .values_list('id', 'category_id', 'title', 'description', 'category__name') \
+            .iterator(chunk_size=chunk_size)
+        matrix = cls.build(
+            (product_id, category_id, get_product_text(title, description, category))
+            for product_id, category_id, title, description, category in rows)
+        matrix.changes = changes
+        return matrix
+
+    def save(self, path):
+        """Write the matrix atomically as a directory of .npy files."""
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in self.arrays:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(tmp_path, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, 'changes.json'), 'w') as f:
+            json.dump(self.changes, f)
+
+        old_path = f'{path}.old'
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved matrix with its arrays memory-mapped read-only."""
+        with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in cls.arrays}
+        try:
+            with open(os.path.join(path, 'changes.json')) as f:
+                changes = json.load(f)
+        except FileNotFoundError:
+            changes = None
+        return cls(vocabulary=vocabulary, changes=changes, **arrays)
+
+    def query_vector(self, query):
+        """Return `(terms, term_ids, weights)` of the normalized query vector."""
+        counts = Counter(term for term in get_search_terms(query) if term in self.vocabulary)
+        terms = list(counts)
+        term_ids = np.fromiter((self.vocabulary[term] for term in terms),
+                               dtype=np.int64, count=len(terms))
+        if not terms:
+            return terms, term_ids, np.empty(0, dtype=np.float32)
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(terms))
+        weights = (1 + np.log(tf)) * self.idf[term_ids]
+        return terms, term_ids, weights / np.linalg.norm(weights)
+
+    def score(self, query):
+        """Cosine similarity of `query` against every product in one pass."""
+        n_docs = len(self.product_ids)
+        _, term_ids, query_weights = self.query_vector(query)
+        if not len(term_ids):
+            return np.zeros(n_docs, dtype=np.float32)
+
+        starts, ends = self.indptr[term_ids], self.indptr[term_ids + 1]
+        postings = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+        posting_weights = np.repeat(query_weights, ends - starts) * self.weights[postings]
+        return np.bincount(self.doc_indices[postings], weights=posting_weights,
+                           minlength=n_docs).astype(np.float32)
+
+    def rows_for(self, product_ids):
+        """Return the matrix rows of the given product ids, skipping unknown ids."""
+        product_ids = np.fromiter(product_ids, dtype=np.int64)
+        if not len(self.product_ids):
+            return np.empty(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.product_ids, product_ids),
+                          len(self.product_ids) - 1)
+        return rows[self.product_ids[rows] == product_ids]
+
+
+class SimilarityEngine:
+    """
+    Scores queries against the saved TF-IDF matrix.
+
+    Products changed since the last rebuild are published to every process
+    through a change feed in the cache. Each process keeps them in a small
+    in-memory delta scored with the saved idf weights, and masks their
+    stale rows in the matrix until `rebuild_similarity_index` runs again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_index_dir()
+        self.matrix = None
+        self._version = None
+        self._position = None
+        self._delta = {}
+        self._removed = set()
+        self._lock = threading.Lock()
+
+    def get_matrix(self):
+        try:
+            version = os.stat(os.path.join(self.path, 'indptr.npy')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if version != self._version:
+                self.matrix = TfidfMatrix.load(self.path)
+                self._version = version
+                self._position = self.matrix.changes or similarity_changes.get_position()
+                self._delta.clear()
+                self._removed.clear()
+            self.apply_changes()
+        return self.matrix
+
+    def apply_changes(self):
+        self._position, changes = similarity_changes.read(self._position)
+        for product_id, category_id, text in changes:
+            self._removed.add(product_id)
+            if text is None:
+                self._delta.pop(product_id, None)
+            else:
+                self._delta[product_id] = (category_id, self.get_weights(text))
+
+    def get_weights(self, text):
+        """The l2 normalized `{term: weight}` of a text, with the saved idf weights."""
+        matrix = self.matrix
+        counts = Counter(term for term in get_search_terms(text) if term in matrix.vocabulary)
+        weights = {term: (1 + np.log(count)) * matrix.idf[matrix.vocabulary[term]]
+                   for term, count in counts.items()}
+        norm = np.sqrt(sum(w ** 2 for w in weights.values())) or 1.0
+        return {term: w / norm for term, w in weights.items()}
+
+    def update_product(self, product):
+        """Index a changed product in the in-memory delta of every process."""
+        text = get_product_text(product.title, product.description, product.category.name)
+        similarity_changes.publish([(product.pk, product.category_id, text)])
+
+    def remove_product(self, product_id):
+        similarity_changes.publish([(product_id, None, None)])
+
+    def top_k(self, query, k=10, category_id=None):
+        """Return up to `k` `(product_id, score)` pairs with a positive score."""
+        matrix = self.get_matrix()
+        if matrix is None:
+            return []
+
+        scores = matrix.score(query)
+        if category_id is not None:
+            scores[matrix.category_ids != int(category_id)] = 0
+        with self._lock:
+            removed = set(self._removed)
+            delta = dict(self._delta)
+        if removed:
+            scores[matrix.rows_for(removed)] = 0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        results = [(int(matrix.product_ids[row]), float(scores[row]))
+                   for row in top if scores[row] > 0]
+
+        if delta:
+            terms, _, query_weights = matrix.query_vector(query)
+            query_terms = dict(zip(terms, query_weights.tolist()))
+            for product_id, (product_category, weights) in delta.items():
+                if category_id is not None and product_category != int(category_id):
+                    continue
+                score = sum(w * weights.get(term, 0.0) for term, w in query_terms.items())
+                if score > 0:
+                    results.append((product_id, float(score)))
+
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:k]
+
+
+similarity_changes = ChangeFeed('similarity')
+similarity_engine = SimilarityEngine()
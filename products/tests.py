@@ -1,3 +1,349 @@
-from django.test import TestCase
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import CustomUser
+
+from .middleware import SimpleMiddleware, ip_resolver
+from .admin import IpAddressAdmin
+from .models import Category, IpAddress, MostViewed, Product, ProductGallery
+from .autocomplete import Autocomplete
+from .importer import ProductImporter
+from .search import get_search_backend
+from .serializers import ProductListSerializer, ProductSerializer
+from .similarity import SimilarityEngine, TfidfMatrix
+from .trending import TrendingScores
+from .view_stats import ViewCompactor, total_views
+
+
+def create_products(count, category=None):
+    """`count` products with two galleries each, one without a resized image."""
+    category = category or Category.objects.create(name='Shirts', slug='shirts')
+    products = Product.objects.bulk_create([
+        Product(title=f'Shirt {i}', slug=f'shirt-{i}', color='red', size='LARGE', price=100 + i,
+                stock=i % 3, sold=i % 5, category=category, poster=f'poster/{i}.jpg',
+                poster_derivatives={'source': f'poster/{i}.jpg', 'widths': {'320': f'poster/{i}-320.webp'}}
+                if i % 2 else {}, description='cotton shirt', active=bool(i % 2), views_count=i * 7)
+        for i in range(count)
+    ])
+    ProductGallery.objects.bulk_create([
+        ProductGallery(product=product, original_images=f'original_images/{product.pk}-{n}.jpg',
+                       resizes_images=f'resizes_images/{product.pk}-{n}.jpg' if n == 0 else '')
+        for product in products for n in range(2)
+    ])
+    return products
+
+
+class ProductListSerializerTests(TestCase):
+    def test_matches_product_serializer(self):
+        create_products(12)
+        queryset = Product.objects.order_by('-views_count', '-id')
+        rows = list(queryset.values(*ProductListSerializer.columns))
+
+        expected = ProductSerializer(queryset.prefetch_related('productgallery_set'), many=True).data
+        self.assertEqual(ProductListSerializer().to_representation(rows), expected)
+
+    def test_rows_are_not_modified(self):
+        create_products(2)
+        rows = list(Product.objects.values(*ProductListSerializer.columns))
+        fetched = [dict(row) for row in rows]
+
+        ProductListSerializer().to_representation(rows)
+        self.assertEqual(rows, fetched)
+
+
+# a local cache, so only the queries of the view itself are counted
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductListQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_products(60)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # count, page and the page's galleries
+        for per_page in (1, 10, 50):
+            with self.subTest(per_page=per_page), self.assertNumQueries(3):
+                response = self.client.get('/products/', {'per_page': per_page})
+                self.assertEqual(len(response.json()['products']), per_page)
+
+    def test_cursor_query_count_does_not_depend_on_page_size(self):
+        # page and the page's galleries
+        for per_page in (1, 10, 50):
+            with self.subTest(per_page=per_page), self.assertNumQueries(2):
+                response = self.client.get('/products/', {'pagination': 'cursor', 'per_page': per_page})
+                self.assertEqual(len(response.json()['products']), per_page)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SharedIndexChangesTests(TestCase):
+    """Edits reach every process through the change feeds, two instances stand in for two workers."""
+
+    def setUp(self):
+        cache.clear()
+        self.products = create_products(3)
+        self.path = tempfile.mkdtemp()
+
+    def rename(self, product, title):
+        product.title = title
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+    def test_autocomplete(self):
+        snapshot = Autocomplete(path=os.path.join(self.path, 'autocomplete.json'))
+        snapshot.build()
+        snapshot.save()
+        workers = [Autocomplete(path=snapshot.path) for _ in range(2)]
+        for worker in workers:
+            worker.load()
+        product = self.products[1]
+
+        self.rename(product, 'Blouse 1')
+        for worker in workers:
+            with self.assertNumQueries(0):
+                self.assertEqual([item['id'] for item in worker.suggest('blouse')['products']], [product.id])
+
+        # queryset updates send no signals
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=product.id).update(active=False)
+            workers[0].update_products([product.id])
+        for worker in workers:
+            self.assertEqual(worker.suggest('blouse')['products'], [])
+
+    def test_similarity(self):
+        TfidfMatrix.from_database().save(os.path.join(self.path, 'similarity'))
+        workers = [SimilarityEngine(os.path.join(self.path, 'similarity')) for _ in range(2)]
+        for worker in workers:
+            worker.get_matrix()
+
+        self.rename(self.products[1], 'Shirt 2')
+        for worker in workers:
+            self.assertEqual({product_id for product_id, _ in worker.top_k('2')},
+                             {self.products[1].id, self.products[2].id})
+
+
+class ZeroWidthNonJoinerSearchTests(TestCase):
+    def test_joined_and_split_spellings_match(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        products = Product.objects.bulk_create([
+            Product(title=title, slug=f'shirt-{i}', color='red', size='LARGE', price=100, category=category)
+            for i, title in enumerate(['پیراهن می\u200cخواهم', 'پیراهن میخواهم'])])
+        backend = get_search_backend()
+        backend.index_products([product.id for product in products])
+
+        def search(query):
+            return {product_id for product_id, _ in backend.search(query)}
+
+        both = {product.id for product in products}
+        self.assertEqual(search('می\u200cخواهم'), both)
+        self.assertEqual(search('میخواهم'), both)
+        self.assertEqual(search('می خواهم'), {products[0].id})
+        self.assertEqual(search('خواهم'), {products[0].id})
+
+
+class ProductImporterTests(TestCase):
+    def test_malformed_rows_are_rejected(self):
+        Category.objects.create(name='Shirts', slug='shirts')
+        row = {'title': 'Shirt', 'color': 'red', 'size': 'LARGE', 'price': 100, 'category': 'shirts'}
+        errors = ProductImporter().import_batch([
+            (1, dict(row, slug='red shirt')),
+            (2, dict(row, slug='shirts/red')),
+            (3, dict(row, category=['shirts'])),
+            (4, dict(row, slug='red-shirt')),
+        ])
+
+        self.assertEqual([line for line, _ in errors], [1, 2, 3])
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['red-shirt'])
+
+
+class ImportedSalesTrendingTests(TestCase):
+    def import_rows(self, *rows):
+        importer = ProductImporter()
+        errors = importer.import_batch([
+            (line, dict(row, title='Shirt', color='red', size='LARGE', price=100, category='shirts'))
+            for line, row in enumerate(rows, 1)])
+        self.assertEqual(errors, [])
+
+    def test_imported_sales_are_not_trending(self):
+        Category.objects.create(name='Shirts', slug='shirts')
+        self.import_rows({'slug': 'shirt-a', 'sold': 500}, {'sold': 1000})
+        self.import_rows({'slug': 'shirt-a', 'sold': 200})
+
+        TrendingScores().update()
+        self.assertEqual(set(Product.objects.values_list('trending_score', flat=True)), {0})
+
+        Product.objects.filter(slug='shirt-a').update(sold=203)
+        TrendingScores().update()
+        self.assertGreater(Product.objects.get(slug='shirt-a').trending_score, 0)
+
+
+@skipUnless(os.environ.get('PRODUCTS_BENCHMARK'), 'set PRODUCTS_BENCHMARK=1 to run the benchmarks')
+class ProductListSerializerBenchmark(TestCase):
+    rounds = 5
+
+    def time(self, serialize):
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            serialize()
+        return (time.perf_counter() - start) / self.rounds * 1000
+
+    def test_page_sizes(self):
+        create_products(1000)
+        for per_page in (100, 1000):
+            queryset = Product.objects.order_by('-views_count', '-id')[:per_page]
+            before = self.time(lambda: ProductSerializer(
+                queryset.all().prefetch_related('productgallery_set'), many=True).data)
+            after = self.time(lambda: ProductListSerializer().to_representation(
+                list(queryset.values(*ProductListSerializer.columns))))
+            print(f'\n{per_page} items: ProductSerializer {before:.1f} ms, ProductListSerializer {after:.1f} ms')
+            self.assertLess(after, before)
+
+
+@skipUnless(os.environ.get('PRODUCTS_BENCHMARK'), 'set PRODUCTS_BENCHMARK=1 to run the benchmarks')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SimilarityBenchmark(TestCase):
+    """The Jaccard loop replaced by the TF-IDF index, both over in-memory product texts."""
+    products = 50000
+    terms_per_product = 25
+    vocabulary_size = 20000
+    queries = 5
+
+    @staticmethod
+    def get_text_similarity(text1, text2):
+        # ProductSearch.get_text_similarity before the TF-IDF index
+        text1 = re.sub(r'[^\w\s]', '', text1.lower())
+        text2 = re.sub(r'[^\w\s]', '', text2.lower())
+        words1 = set(text1.split())
+        words2 = set(text2.split())
+        union = len(words1.union(words2))
+        return len(words1.intersection(words2)) / union if union > 0 else 0
+
+    def test_top_k(self):
+        rnd = random.Random(0)
+        vocabulary = [f'term{i}' for i in range(self.vocabulary_size)]
+        texts = [' '.join(rnd.choices(vocabulary, k=self.terms_per_product)) for _ in range(self.products)]
+        queries = [' '.join(rnd.choices(vocabulary, k=3)) for _ in range(self.queries)]
+
+        path = os.path.join(tempfile.mkdtemp(), 'similarity')
+        started = time.perf_counter()
+        TfidfMatrix.build((product_id, 1, text) for product_id, text in enumerate(texts, 1)).save(path)
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for query in queries:
+            scores = [(product_id, self.get_text_similarity(query, text))
+                      for product_id, text in enumerate(texts, 1)]
+            sorted(scores, key=lambda item: item[1], reverse=True)[:10]
+        before = (time.perf_counter() - started) / len(queries) * 1000
+
+        engine = SimilarityEngine(path)
+        engine.get_matrix()
+        started = time.perf_counter()
+        for query in queries:
+            engine.top_k(query, 10)
+        after = (time.perf_counter() - started) / len(queries) * 1000
+
+        print(f'\n{self.products} products: Jaccard loop {before:.1f} ms, TF-IDF top-10 {after:.2f} ms '
+              f'per query, index built in {build:.1f} s')
+        self.assertLess(after, before)
+
+
+@skipUnless(os.environ.get('PRODUCTS_BENCHMARK'), 'set PRODUCTS_BENCHMARK=1 to run the benchmarks')
+class IpAddressMiddlewareBenchmark(TransactionTestCase):
+    """A query per request against the buffered resolver; the resolver flushes from its own thread."""
+    requests = 20000
+    addresses = 500
+
+    @staticmethod
+    def legacy_middleware(get_response):
+        # SimpleMiddleware before the resolver
+        def middleware(request):
+            ip = request.META.get('REMOTE_ADDR')
+            try:
+                ip_address = IpAddress.objects.get(ip_address=ip)
+            except IpAddress.DoesNotExist:
+                ip_address = IpAddress(ip_address=ip)
+                ip_address.save()
+            request.META['ip_address'] = ip_address
+            return get_response(request)
+        return middleware
+
+    def time(self, middleware, network):
+        factory = RequestFactory()
+        requests = [factory.get('/', REMOTE_ADDR=f'{network}.{i // 250}.{i % 250 + 1}')
+                    for i in range(self.addresses)]
+        started = time.perf_counter()
+        for i in range(self.requests):
+            middleware(requests[i % self.addresses])
+        return (time.perf_counter() - started) / self.requests * 1e6
+
+    def test_requests(self):
+        # distinct networks, so neither run finds the addresses of the other
+        before = self.time(self.legacy_middleware(lambda request: HttpResponse()), '10.1')
+        after = self.time(SimpleMiddleware(lambda request: HttpResponse()), '10.2')
+        ip_resolver.flush()
+
+        print(f'\n{self.requests} requests over {self.addresses} addresses: '
+              f'query per request {before:.0f} us, resolver {after:.0f} us per request')
+        self.assertEqual(IpAddress.objects.filter(ip_address__startswith='10.2.').count(), self.addresses)
+        self.assertLess(after, before)
+
+
+@skipUnless(os.environ.get('PRODUCTS_BENCHMARK'), 'set PRODUCTS_BENCHMARK=1 to run the benchmarks')
+class ViewCompactionBenchmark(TestCase):
+    """A year of synthetic views, before and after compacting all but the last 90 days."""
+    views = 200000
+    days = 365
+    products = 200
+    users = 100
+    addresses = 500
+
+    def create_views(self):
+        rnd = random.Random(0)
+        products = create_products(self.products)
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'viewer{i}', email=f'viewer{i}@example.com') for i in range(self.users)])
+        ips = IpAddress.objects.bulk_create([
+            IpAddress(ip_address=f'10.0.{i // 250}.{i % 250 + 1}') for i in range(self.addresses)])
+        last_id = 0
+        now = timezone.now()
+        for day in range(self.days):
+            MostViewed.objects.bulk_create([
+                MostViewed(product=rnd.choice(products), user=rnd.choice(users), ip=rnd.choice(ips))
+                for _ in range(self.views // self.days)], batch_size=1000)
+            # created is auto_now_add, so date the day's rows afterwards
+            MostViewed.objects.filter(id__gt=last_id).update(created=now - timedelta(days=day))
+            last_id = MostViewed.objects.latest('id').id
+
+    def measure(self):
+        started = time.perf_counter()
+        list(IpAddressAdmin(IpAddress, admin.site).get_queryset(RequestFactory().get('/'))
+             .order_by('-_views_count')[:100])
+        admin_top = time.perf_counter() - started
+        started = time.perf_counter()
+        top = list(Product.objects.annotate(views=total_views()).order_by('-views', 'id')
+                   .values_list('id', 'views')[:20])
+        return MostViewed.objects.count(), admin_top * 1000, (time.perf_counter() - started) * 1000, top
+
+    def test_compaction(self):
+        self.create_views()
+        rows_before, admin_before, top_before, views_before = self.measure()
+        started = time.perf_counter()
+        ViewCompactor(days=90).compact()
+        compaction = time.perf_counter() - started
+        rows_after, admin_after, top_after, views_after = self.measure()
+
+        print(f'\nraw rows {rows_before} -> {rows_after}, IpAddressAdmin top 100 {admin_before:.0f} -> '
+              f'{admin_after:.0f} ms, top 20 by total_views() {top_before:.0f} -> {top_after:.0f} ms, '
+              f'compaction {compaction:.1f} s')
+        self.assertEqual(views_after, views_before)
+        self.assertLess(rows_after, rows_before)
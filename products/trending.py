@@ -0,0 +1,142 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, FloatField, IntegerField
+from django.utils import timezone
+
+from rating.models import Rating
+
+from .models import MostViewed, Product, TrendingState
+from .response_cache import response_cache
+from .utils import per_product
+
+VIEW_WEIGHT = getattr(settings, 'TRENDING_VIEW_WEIGHT', 1)
+SOLD_WEIGHT = getattr(settings, 'TRENDING_SOLD_WEIGHT', 10)
+# per star above or below a neutral 3 star rating
+RATING_WEIGHT = getattr(settings, 'TRENDING_RATING_WEIGHT', 2)
+HALF_LIFE = timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 72))
+# scores are rebased once event weights reach 2 ** MAX_EXPONENT
+MAX_EXPONENT = 64
+
+
+class TrendingScores:
+    """
+    Exponentially decayed popularity of every product.
+
+    Uses forward decay: an event at time t adds `weight * 2 ** ((t - epoch)
+    / half_life)` to its product's score instead of decaying every stored
+    score as time passes. All scores would decay by the same factor, so the
+    ranking is the same, and a run only touches the products with new
+    views, sales or ratings since the previous one. When the weights of
+    new events grow too large the stored scores are rebased to a new epoch
+    in one UPDATE.
+    """
+
+    def __init__(self, half_life=HALF_LIFE, chunk_size=10000):
+        self.half_life = half_life.total_seconds()
+        self.chunk_size = chunk_size
+        self.changed = 0
+
+    def get_state(self, now):
+        state = TrendingState.objects.select_for_update().first()
+        if state is None:
+            state = TrendingState.objects.create(epoch=now)
+        return state
+
+    def get_weights(self, timestamps, epoch):
+        return np.exp2((np.asarray(timestamps, dtype=np.float64) - epoch.timestamp()) / self.half_life)
+
+    def add_scores(self, scores, sold=None):
+        """Add `{product_id: score}` to the stored scores, `sold` records the counted sales."""
+        scores = list(scores.items())
+        for start in range(0, len(scores), 500):
+            batch = dict(scores[start:start + 500])
+            updates = {'trending_score': F('trending_score') + per_product(batch, FloatField())}
+            if sold is not None:
+                updates['trending_sold'] = per_product(
+                    {product_id: sold[product_id] for product_id in batch}, IntegerField())
+            Product.objects.filter(id__in=batch.keys()).update(**updates)
+        self.changed += len(scores)
+
+    def add_events(self, rows, epoch):
+        """Add `(product_id, timestamp, weight)` events to the scores."""
+        product_ids, timestamps, weights = zip(*rows)
+        product_ids, columns = np.unique(np.asarray(product_ids, dtype=np.int64), return_inverse=True)
+        scores = np.bincount(columns, weights=np.asarray(weights) * self.get_weights(timestamps, epoch))
+        self.add_scores(dict(zip(product_ids.tolist(), scores.tolist())))
+
+    def rebase(self, state, now):
+        factor = float(2 ** (-(now - state.epoch).total_seconds() / self.half_life))
+        Product.objects.exclude(trending_score=0).update(trending_score=F('trending_score') * factor)
+        state.epoch = now
+
+    def update_views(self):
+        while True:
+            with transaction.atomic():
+                state = self.get_state(timezone.now())
+                rows = list(MostViewed.objects.filter(id__gt=state.last_view_id).order_by('id')
+                            .values_list('id', 'product_id', 'created')[:self.chunk_size])
+                if not rows:
+                    return
+                self.add_events([(product_id, created.timestamp(), VIEW_WEIGHT)
+                                 for _, product_id, created in rows], state.epoch)
+                state.last_view_id = rows[-1][0]
+                state.save()
+
+    def update_ratings(self):
+        content_type = ContentType.objects.get_for_model(Product)
+        while True:
+            with transaction.atomic():
+                state = self.get_state(timezone.now())
+                rows = list(Rating.objects.filter(content_type=content_type, id__gt=state.last_rating_id)
+                            .order_by('id').values_list('id', 'object_id', 'score', 'created_at')[:self.chunk_size])
+                if not rows:
+                    return
+                self.add_events([(product_id, created.timestamp(), RATING_WEIGHT * (score - 3))
+                                 for _, product_id, score, created in rows], state.epoch)
+                state.last_rating_id = rows[-1][0]
+                state.save()
+
+    def update_sales(self):
+        """
+        Count the sales since the last run, dated now: `sold` keeps no sale dates.
+
+        A lower `sold`, from a refund or a correction, only moves the baseline.
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            state = self.get_state(now)
+            weight = SOLD_WEIGHT * float(self.get_weights([now.timestamp()], state.epoch)[0])
+            rows = list(Product.objects.exclude(sold=F('trending_sold'))
+                        .values_list('id', 'sold', 'trending_sold'))
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = rows[start:start + self.chunk_size]
+                self.add_scores({product_id: weight * max(sold_now - sold_before, 0)
+                                 for product_id, sold_now, sold_before in chunk},
+                                {product_id: sold_now for product_id, sold_now, _ in chunk})
+
+    def update(self):
+        """Fold the events since the previous run into the scores; returns the number of updates."""
+        with transaction.atomic():
+            now = timezone.now()
+            state = self.get_state(now)
+            if (now - state.epoch).total_seconds() / self.half_life > MAX_EXPONENT:
+                self.rebase(state, now)
+                state.save()
+
+        self.update_views()
+        self.update_ratings()
+        self.update_sales()
+        if self.changed:
+            response_cache.invalidate('product-trending')
+        return self.changed
+
+    def reset(self):
+        """Forget all scores; the next update recomputes them from every view and rating."""
+        with transaction.atomic():
+            TrendingState.objects.all().delete()
+            Product.objects.update(trending_score=0, trending_sold=F('sold'))
+        response_cache.invalidate('product-trending')
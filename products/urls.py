@@ -13,7 +13,10 @@ urlpatterns = [
 
     # Product
     path('products/', views.ProductListAPIView.as_view(), name='product-list'),
+    path('product-facets/', views.ProductFacetsAPIView.as_view(), name='product-facets'),
     path('products/<slug:slug>/',views.ProductDetailAPIView.as_view(), name='product-detail'),
+    path('product-export/', views.ProductExportAPIView.as_view(), name='product-export'),
     # search
-#     path('product-search/', views.ProductSearchView.as_view(), name='product-search'),
+    path('product-search/', views.ProductSearchView.as_view(), name='product-search'),
+    path('product-autocomplete/', views.ProductAutocompleteAPIView.as_view(), name='product-autocomplete'),
 ]
@@ -0,0 +1,168 @@
+import logging
+import time
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Value, When
+
+from .models import Category
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TREE_CACHE_KEY = 'products_category_tree'
+CATEGORY_DESCENDANTS_CACHE_KEY = 'products_category_descendants'
+CATALOG_VERSION_CACHE_KEY = 'products_catalog_version'
+# saves invalidate the tree right away; the timeout bounds the damage of a missed invalidation
+CATEGORY_TREE_CACHE_TIMEOUT = getattr(settings, 'CATEGORY_TREE_CACHE_TIMEOUT', 3600)
+
+
+def build_category_tree():
+    """Build the nested category tree in a single query using the MPTT columns."""
+    # cached until the next change without a version, so never built from a lagging replica
+    rows = Category.objects.using(DEFAULT_DB_ALIAS).order_by('tree_id', 'lft').values(
+        'id', 'name', 'slug', 'parent', 'statuses', 'tree_id', 'lft', 'rght')
+
+    tree = []
+    stack = []
+    for row in rows:
+        tree_id, lft, rght = row.pop('tree_id'), row.pop('lft'), row.pop('rght')
+        node = dict(row, children=[])
+
+        # drop ancestors whose subtree ends before this node
+        while stack and (stack[-1][0] != tree_id or stack[-1][1] < lft):
+            stack.pop()
+
+        if stack:
+            stack[-1][2]['children'].append(node)
+        else:
+            tree.append(node)
+        stack.append((tree_id, rght, node))
+    return tree
+
+
+def get_category_tree():
+    """Return the serialized category tree, building and caching it on a miss."""
+    tree = cache.get(CATEGORY_TREE_CACHE_KEY)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(CATEGORY_TREE_CACHE_KEY, tree, CATEGORY_TREE_CACHE_TIMEOUT)
+    return tree
+
+
+def build_category_descendants():
+    """
+    Map every category slug to the ids of its subtree, itself included.
+
+    In `tree_id, lft` order a node's subtree is the run of
+    `(rght - lft - 1) / 2` rows right after it, so one query is enough.
+    """
+    rows = list(Category.objects.using(DEFAULT_DB_ALIAS).order_by('tree_id', 'lft').values_list('id', 'slug', 'lft', 'rght'))
+    ids = [category_id for category_id, _, _, _ in rows]
+    return {
+        slug: ids[index:index + (rght - lft + 1) // 2]
+        for index, (_, slug, lft, rght) in enumerate(rows)
+    }
+
+
+def get_category_descendants(slug):
+    """Return the ids of the category `slug` and all its descendants, or None."""
+    descendants = cache.get(CATEGORY_DESCENDANTS_CACHE_KEY)
+    if descendants is None:
+        descendants = build_category_descendants()
+        cache.set(CATEGORY_DESCENDANTS_CACHE_KEY, descendants, CATEGORY_TREE_CACHE_TIMEOUT)
+    return descendants.get(slug)
+
+
+def invalidate_category_tree():
+    cache.delete_many([CATEGORY_TREE_CACHE_KEY, CATEGORY_DESCENDANTS_CACHE_KEY])
+
+
+def get_query_params_key(query_params, ignored=()):
+    """Hash the query params, ignoring order and the given keys."""
+    params = sorted(
+        (key, value) for key, values in query_params.lists()
+        if key not in ignored for value in values)
+    return md5(urlencode(params).encode()).hexdigest()
+
+
+def get_catalog_version():
+    """
+    Version of the product catalog, set on every product change.
+
+    The version is the time of the change in nanoseconds, so an evicted
+    version never comes back and `read_from_primary` can tell whether the
+    replicas have caught up with it.
+    """
+    version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_CACHE_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_CACHE_KEY, time.time_ns(), None)
+
+
+def per_product(values, output_field):
+    """`CASE id WHEN ... THEN value END` for batched per-product updates."""
+    return Case(*(When(id=product_id, then=Value(value)) for product_id, value in values.items()),
+                output_field=output_field)
+
+
+class ChangeFeed:
+    """
+    Changes to a per-process index, shared with every process through the cache.
+
+    Each `publish` stores its list of changes under the next number of a
+    shared counter. Readers remember the last number they applied and
+    fetch the newer lists with one `get_many`, so they never touch the
+    database. Snapshots record the number they were built at. The counter
+    starts from the clock, so a reader that lost track, through an evicted
+    counter or by falling more than `max_behind` lists behind, sees a gap
+    and skips to the end; it is current again after the next snapshot.
+    """
+
+    def __init__(self, name, timeout=24 * 3600, max_behind=5000):
+        self.key = f'{name}_changes'
+        self.timeout = timeout
+        self.max_behind = max_behind
+
+    def get_position(self):
+        position = cache.get(self.key)
+        if position is None:
+            cache.add(self.key, time.time_ns(), None)
+            position = cache.get(self.key)
+        return position
+
+    def publish(self, changes):
+        """Share `changes` with every process once the current transaction commits."""
+        def publish():
+            try:
+                position = cache.incr(self.key)
+            except ValueError:
+                cache.add(self.key, time.time_ns(), None)
+                position = cache.incr(self.key)
+            cache.set(f'{self.key}_{position}', changes, self.timeout)
+        transaction.on_commit(publish)
+
+    def read(self, position):
+        """Return the position to read from next and the changes published after `position`."""
+        latest = self.get_position()
+        if latest == position:
+            return position, []
+        if position is None or not 0 < latest - position <= self.max_behind:
+            logger.warning(f"Lost track of {self.key}, changes are missing until the next snapshot")
+            return latest, []
+
+        keys = [f'{self.key}_{number}' for number in range(position + 1, latest + 1)]
+        lists = cache.get_many(keys)
+        # the last numbers may be taken but not stored yet, read them next time
+        while keys and keys[-1] not in lists:
+            keys.pop()
+        if len(lists) < len(keys):
+            logger.warning(f"{len(keys) - len(lists)} lists of {self.key} were evicted before they were read")
+        return position + len(keys), [change for key in keys if key in lists for change in lists[key]]
@@ -0,0 +1,133 @@
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, IntegerField
+
+from .middleware import ip_resolver
+from .models import MostViewed, Product, ProductViewer
+from .utils import per_product
+
+
+class ViewRecorder:
+    """
+    Process-local buffer of product detail views.
+
+    A repeat of an (ip, user, product) view within `window` seconds is
+    dropped. Keys live in two time buckets of `window` seconds, the current
+    and the previous one, which are the only ones that can still hold a
+    view inside the window, so memory is bounded by the views of the last
+    two windows. Accepted views are written by a background thread every
+    `flush_interval` seconds, or as soon as `flush_size` are buffered: one
+    `bulk_create` of `MostViewed` rows plus batched updates of
+    `Product.views_count` and the `ProductViewer` rollup, in one
+    transaction.
+    """
+
+    def __init__(self, window=1800, flush_size=500, flush_interval=5, max_pending=50000):
+        self.window = window
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._seen = {}
+        self._pending = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def is_repeat(self, key, now):
+        bucket = int(now // self.window)
+        current = self._seen.get(bucket)
+        if current is None:
+            self._seen = {bucket - 1: self._seen.get(bucket - 1, {})}
+            current = self._seen[bucket] = {}
+        seen = current.get(key) or self._seen[bucket - 1].get(key)
+        if seen is not None and now - seen < self.window:
+            return True
+        current[key] = now
+        return False
+
+    def record(self, slug, user_id, ip):
+        """Buffer a view of the product `slug`; returns False for a repeat view."""
+        with self._lock:
+            if self.is_repeat((ip, user_id, slug), time.time()):
+                return False
+            self._pending.append((slug, user_id, ip))
+            if len(self._pending) > self.max_pending:
+                # the database is unreachable, keep the newest views
+                del self._pending[:-self.max_pending]
+            full = len(self._pending) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='product-views', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write the buffered views; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                return self.write(pending)
+            except DatabaseError:
+                # keep the views buffered and retry on the next flush
+                with self._lock:
+                    self._pending[:0] = pending
+                    del self._pending[:-self.max_pending]
+                return 0
+
+    def write(self, views):
+        products = dict(Product.objects.filter(slug__in={slug for slug, _, _ in views})
+                        .values_list('slug', 'id'))
+        ips = {ip: ip_resolver.resolve(ip) for ip in {ip for _, _, ip in views}}
+        rows = [MostViewed(product_id=products[slug], user_id=user_id, ip=ips[ip])
+                for slug, user_id, ip in views if slug in products and ips[ip] is not None]
+        if not rows:
+            return 0
+
+        # bulk_create skips the MostViewed signals, so the counters are updated here
+        views_count = Counter(row.product_id for row in rows)
+        with transaction.atomic():
+            MostViewed.objects.bulk_create(rows, batch_size=1000)
+            items = list(views_count.items())
+            for start in range(0, len(items), 500):
+                batch = dict(items[start:start + 500])
+                Product.objects.filter(id__in=batch.keys()) \
+                    .update(views_count=F('views_count') + per_product(batch, IntegerField()))
+            ProductViewer.objects.increment_many(Counter((row.product_id, row.user_id) for row in rows))
+        # cached responses keep their views_count until they expire: evicting them on
+        # every flush would cap their life at `flush_interval` under steady traffic
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            connection.close_if_unusable_or_obsolete()
+            self.flush()
+
+    def _reset_after_fork(self):
+        # the flush thread does not survive fork; buffered views stay with the parent
+        self._thread = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+
+view_recorder = ViewRecorder(
+    window=getattr(settings, 'PRODUCT_VIEW_DEDUP_WINDOW', 1800),
+    flush_size=getattr(settings, 'PRODUCT_VIEW_FLUSH_SIZE', 500),
+    flush_interval=getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', 5),
+)
+atexit.register(view_recorder.flush)
+os.register_at_fork(after_in_child=view_recorder._reset_after_fork)
@@ -0,0 +1,95 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DailyProductViews, MostViewed, TrendingState
+
+RETENTION_DAYS = getattr(settings, 'PRODUCT_VIEW_RETENTION_DAYS', 90)
+
+
+def get_day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def total_views(product=OuterRef('pk'), since=None):
+    """
+    Expression for the views of `product`, counting both raw `MostViewed`
+    rows and the days already compacted into `DailyProductViews`.
+
+    `since` (a date) only counts the views from that day on, e.g.
+    `Product.objects.annotate(views=total_views(since=last_week))`.
+    """
+    raw = MostViewed.objects.filter(product=product)
+    daily = DailyProductViews.objects.filter(product=product)
+    if since is not None:
+        raw = raw.filter(created__gte=get_day_range(since)[0])
+        daily = daily.filter(day__gte=since)
+    raw_views = raw.order_by().values('product').annotate(views=Count('id')).values('views')
+    daily_views = daily.order_by().values('product').annotate(views=Sum('views')).values('views')
+    return Coalesce(Subquery(raw_views), 0) + Coalesce(Subquery(daily_views), 0)
+
+
+class ViewCompactor:
+    """
+    Folds `MostViewed` rows older than `days` days into `DailyProductViews`.
+
+    One day at a time, the aggregates of the day are computed in SQL and
+    inserted in one transaction, then its raw rows are deleted in batches
+    of `batch_size`, each in its own short transaction. A day that already
+    has aggregates was folded by an interrupted run and only has its
+    leftover rows deleted, so the job can be stopped and rerun at any
+    time. Rows not yet counted by the trending scores are kept.
+    """
+
+    def __init__(self, days=RETENTION_DAYS, batch_size=5000):
+        self.days = days
+        self.batch_size = batch_size
+        self.compacted = 0
+        self.deleted = 0
+
+    def get_cutoff(self):
+        return get_day_range(timezone.localdate() - timedelta(days=self.days))[0]
+
+    def get_next_day(self, cutoff):
+        created = MostViewed.objects.filter(created__lt=cutoff).order_by('created') \
+            .values_list('created', flat=True).first()
+        return timezone.localdate(created) if created is not None else None
+
+    def fold(self, day, rows):
+        with transaction.atomic():
+            if DailyProductViews.objects.filter(day=day).exists():
+                return
+            aggregates = rows.order_by().values('product') \
+                .annotate(views=Count('id'), viewers=Count('user', distinct=True))
+            DailyProductViews.objects.bulk_create([
+                DailyProductViews(product_id=row['product'], day=day, views=row['views'], viewers=row['viewers'])
+                for row in aggregates
+            ], batch_size=1000)
+        self.compacted += 1
+
+    def delete(self, rows):
+        while True:
+            with transaction.atomic():
+                ids = list(rows.order_by('id').values_list('id', flat=True)[:self.batch_size])
+                if not ids:
+                    return
+                # a plain DELETE: the post_delete signals would decrement the view counters
+                self.deleted += MostViewed.objects.filter(id__in=ids)._raw_delete(MostViewed.objects.db)
+
+    def compact(self):
+        cutoff = self.get_cutoff()
+        trending = TrendingState.objects.first()
+        while (day := self.get_next_day(cutoff)) is not None:
+            start, end = get_day_range(day)
+            rows = MostViewed.objects.filter(created__gte=start, created__lt=end)
+            if trending is not None and rows.filter(id__gt=trending.last_view_id).exists():
+                # run update_trending_scores first
+                break
+            self.fold(day, rows)
+            self.delete(rows)
+        return self.compacted, self.deleted
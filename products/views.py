@@ -1,6 +1,13 @@
-import re
-
-from django.db.models import Q, OuterRef, Subquery, Count
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.db.models import Q, F
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import DatabaseError
@@ -10,10 +17,21 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import replace_query_param
 
-from .models import Category, Product, ProductGallery, MostViewed
-from .serializers import CategorySerializer, ProductSerializer, ProductDetailSerializer, ProductGallerySerializer, ProductSearchSerializer
+from .models import Product, ProductGallery
+from .utils import get_category_tree, get_category_descendants, get_query_params_key
+from .search import get_search_backend
+from .similarity import similarity_engine
+from .facets import ProductFacets
+from .export import ProductExporter
+from .autocomplete import autocomplete
+from .response_cache import cache_response, response_cache
+from .middleware import get_client_ip
+from .view_events import view_recorder
+from .serializers import ProductListSerializer, ProductDetailSerializer, ProductGalleryRowSerializer, ProductSearchSerializer
 
 
 # Category List API View
@@ -24,24 +42,14 @@ class CategoryListAPIView(APIView):
     filter_backends = [DjangoFilterBackend, SearchFilter]
     search_fields = ['name', 'slug']
 
+    def get_cache_tags(self, request):
+        return ['categories']
+
+    @cache_response
     def get(self, request):
-        """Retrieve all categories from the database ."""
+        """Retrieve the category tree, served from cache when possible."""
         try:
-            categories = Category.objects.all()
-            # category_dict = {category.id: category for category in categories}  # Create a dictionary for quick access
-            result = []
-
-            for category in categories:
-                if category.parent is None:  
-                    serialized_category = CategorySerializer(category).data
-                    serialized_category['children'] = []  
-
-                    for child in categories:
-                        if child.parent == category:
-                            serialized_category['children'].append(CategorySerializer(child).data)
-
-                    result.append(serialized_category)
-
+            result = get_category_tree()
             return Response(result, status=status.HTTP_200_OK)  # Return the serialized data
         except DatabaseError as db_error:
             return Response({'error': 'Database error occurred: ' + str(db_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -83,31 +91,94 @@ class CategoryListAPIView(APIView):
 # Product Gallery List API View
 class ProductGalleryListAPIView(APIView):
     """
-    API view to retrieve product gallery images.
+    API view to retrieve product gallery images, grouped by product.
+
+    Query Parameters (one of):
+    - product_id: the galleries of one product, 404 when it has none
+    - product_ids / slugs: comma separated ids or slugs of up to
+      `max_batch_size` products, e.g. a whole product grid, fetched in one
+      query and keyed by the given id or slug
+    - none: every product with galleries, `per_page` products per page in
+      product id order, continued with the `next` link
     """
+    max_batch_size = 100
+    page_size = 20
+    serializer = ProductGalleryRowSerializer()
+
+    def get_lookup(self, request):
+        """Return `(lookup, values)` of the requested products, or `(None, None)` for all of them."""
+        params = request.query_params
+        if params.get('product_id'):
+            return 'product_id', [self.parse_id(params['product_id'])]
+        for param, lookup in (('product_ids', 'product_id'), ('slugs', 'product__slug')):
+            if params.get(param):
+                values = list(dict.fromkeys(value.strip() for value in params[param].split(',') if value.strip()))
+                if len(values) > self.max_batch_size:
+                    raise ValidationError(f'At most {self.max_batch_size} products can be requested at once.')
+                if lookup == 'product_id':
+                    values = [self.parse_id(value) for value in values]
+                return lookup, values
+        return None, None
+
+    def parse_id(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError(f'Invalid product id: {value}')
+
+    def get_cache_tags(self, request):
+        try:
+            lookup, values = self.get_lookup(request)
+        except ValidationError:
+            lookup = None
+        if lookup == 'product_id':
+            return [f'product-galleries:{product_id}' for product_id in values]
+        return ['product-galleries']
+
+    def get_galleries(self, lookup, values):
+        """Galleries of the products whose `lookup` is in `values`, keyed by that value."""
+        columns = [*self.serializer.columns, lookup] if lookup != 'product_id' else self.serializer.columns
+        rows = ProductGallery.objects.filter(**{f'{lookup}__in': values}) \
+            .order_by('product_id', 'id').values(*columns)
+        galleries = {value: [] for value in values}
+        for row in rows:
+            galleries[row[lookup]].append(self.serializer.to_representation(row))
+        return galleries
+
+    def get_page(self, request):
+        try:
+            per_page = max(1, min(int(request.query_params.get('per_page', self.page_size)), self.max_batch_size))
+        except ValueError:
+            raise ValidationError('per_page must be an integer.')
+        cursor = self.parse_id(request.query_params.get('cursor', 0))
+
+        # served by the product_id index of the gallery table
+        product_ids = list(ProductGallery.objects.filter(product_id__gt=cursor).order_by('product_id')
+                           .values_list('product_id', flat=True).distinct()[:per_page + 1])
+        has_next = len(product_ids) > per_page
+        product_ids = product_ids[:per_page]
+        return {
+            'next': replace_query_param(request.build_absolute_uri(), 'cursor', product_ids[-1])
+            if has_next else None,
+            'galleries': self.get_galleries('product_id', product_ids),
+        }
+
+    @cache_response
     def get(self, request):
-        product_id = request.query_params.get('product_id')
         try:
-            if product_id:
-                galleries = ProductGallery.objects.filter(product_id=product_id)
-                if not galleries.exists():
+            if request.query_params.get('product_id'):
+                galleries = self.get_galleries(*self.get_lookup(request))
+                if not any(galleries.values()):
                     return Response({'message': 'No galleries found for the specified product.'}, status=status.HTTP_404_NOT_FOUND)
-            else:
-                galleries = ProductGallery.objects.all()
-            
-            grouped_galleries = {}
-            for gallery in galleries:
-                if gallery.product_id not in grouped_galleries:
-                    grouped_galleries[gallery.product_id] = []
-                grouped_galleries[gallery.product_id].append(gallery)
-
-            response_data = {}
-            for product_id, gallery_list in grouped_galleries.items():
-                serializer = ProductGallerySerializer(gallery_list, many=True)
-                response_data[product_id] = serializer.data
+                return Response(galleries, status=status.HTTP_200_OK)
 
-            return Response(response_data, status=status.HTTP_200_OK)
+            lookup, values = self.get_lookup(request)
+            if lookup is None:
+                return Response(self.get_page(request), status=status.HTTP_200_OK)
+            return Response(self.get_galleries(lookup, values), status=status.HTTP_200_OK)
 
+        except ValidationError as val_error:
+            return Response({'error': 'Validation error occurred: ' + str(val_error)}, status=status.HTTP_400_BAD_REQUEST)
         except DatabaseError as db_error:
             return Response({'error': 'Database error occurred: ' + str(db_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as e:
@@ -127,7 +198,142 @@ class ProductPagination(PageNumberPagination):
             'previous': self.get_previous_link(),
             'products': data
         })
-        
+
+
+class ProductCursorPagination:
+    """
+    Keyset pagination for infinite scroll.
+
+    Pages are selected with `(field, id)` comparisons against the last row
+    of the previous page instead of OFFSET, so every page costs the same.
+    The cursor is an opaque token and the total count is only computed
+    (and cached) when `with_count=true` is passed.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'per_page'
+    cursor_query_param = 'cursor'
+    count_cache_timeout = 60
+    orderings = {
+        'newest': '-created',
+        'best_selling': '-sold',
+        'cheapest': 'price',
+        'most_expensive': '-price',
+        'most_viewed': '-views_count',
+        'trending': '-trending_score',
+    }
+    aliases = {
+        '-view_count_annotation': 'most_viewed',
+    }
+    ignored_count_params = ('cursor', 'per_page', 'pagination', 'with_count', 'ordering', 'page')
+
+    def get_ordering_key(self, request):
+        ordering = request.query_params.get('ordering', 'most_viewed')
+        ordering = self.aliases.get(ordering, ordering)
+        for key, field in self.orderings.items():
+            if ordering in (key, field):
+                return key
+        raise ValidationError(f"Invalid ordering option for cursor pagination: {ordering}")
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError('per_page must be an integer.')
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, ordering_key, product):
+        field = self.orderings[ordering_key].lstrip('-')
+        # pages are `.values()` rows on the list view
+        value, product_id = (product[field], product['id']) if isinstance(product, dict) \
+            else (getattr(product, field), product.id)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        payload = json.dumps([ordering_key, value, product_id], separators=(',', ':'))
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, ordering_key):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            payload = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            cursor_ordering, value, last_id = json.loads(payload)
+            if cursor_ordering != ordering_key:
+                raise ValidationError('Cursor does not match the requested ordering.')
+            value = self.parse_cursor_value(ordering_key, value)
+            if type(last_id) is not int:
+                raise ValueError(last_id)
+        except (ValueError, TypeError):
+            raise ValidationError('Invalid cursor.')
+        return value, last_id
+
+    def parse_cursor_value(self, ordering_key, value):
+        """Check the type of a decoded cursor value, raising ValueError for a tampered one."""
+        if ordering_key == 'newest':
+            value = parse_datetime(value) if isinstance(value, str) else None
+            if value is None:
+                raise ValueError('Invalid cursor date.')
+            return value
+        # bool is an int subclass but never a stored value
+        types = (int, float) if ordering_key == 'trending' else (int,)
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ValueError(value)
+        return value
+
+    def get_count(self, queryset, request):
+        cache_key = 'products_count_' + get_query_params_key(
+            request.query_params, self.ignored_count_params)
+        count = cache.get(cache_key)
+        if count is None:
+            count = queryset.order_by().count()
+            cache.set(cache_key, count, self.count_cache_timeout)
+        return count
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        self.ordering_key = self.get_ordering_key(request)
+        self.page_size_value = self.get_page_size(request)
+
+        ordering = self.orderings[self.ordering_key]
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        lookup = 'lt' if descending else 'gt'
+
+        self.count = self.get_count(queryset, request) \
+            if request.query_params.get('with_count') == 'true' else None
+
+        queryset = queryset.order_by(ordering, '-id' if descending else 'id')
+        position = self.decode_cursor(request, self.ordering_key)
+        if position is not None:
+            value, last_id = position
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) |
+                Q(**{field: value, f'id__{lookup}': last_id}))
+
+        rows = list(queryset[:self.page_size_value + 1])
+        self.page = rows[:self.page_size_value]
+        self.has_next = len(rows) > self.page_size_value
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        cursor = self.encode_cursor(self.ordering_key, self.page[-1])
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        response = {
+            'per_page': self.page_size_value,
+            'next': self.get_next_link(),
+            'products': data
+        }
+        if self.count is not None:
+            response['total_products'] = self.count
+        return Response(response)
+
+
 #  Products
 class ProductQuerySet:
     def __init__(self, queryset, error_handler):
@@ -136,10 +342,7 @@ class ProductQuerySet:
 
     def apply_search(self, search_query):
         if search_query:
-            self.queryset = self.queryset.filter(
-                Q(title__icontains=search_query) | 
-                Q(description__icontains=search_query)
-            ).distinct()
+            self.queryset = get_search_backend().filter_queryset(self.queryset, search_query)
         return self.queryset
 
     def apply_filters(self, request):
@@ -187,9 +390,14 @@ class ProductQuerySet:
                 self.error_handler('Invalid value for in_stock. Must be "true" or "false".', status_code=400)
                 return self.queryset  
 
+        elif key == 'category':
+            # the whole subtree, from one cached id list instead of recursive queries
+            category_ids = get_category_descendants(value)
+            return self.queryset.filter(category_id__in=category_ids or [])
+
         else:
             try:
-                return self.queryset.filter(**{f"{key}__slug" if key == 'category' else key: value})
+                return self.queryset.filter(**{key: value})
             except Exception as e:
                 self.error_handler(f'Error applying filter for {key}: {str(e)}', status_code=400)
                 return self.queryset 
@@ -197,79 +405,80 @@ class ProductQuerySet:
 
 class ProductSearch:
     @staticmethod
-    def get_text_similarity(text1, text2):
-        """محاسبه شباهت متنی ساده"""
-        text1 = re.sub(r'[^\w\s]', '', text1.lower())
-        text2 = re.sub(r'[^\w\s]', '', text2.lower())
-        
-        words1 = set(text1.split())
-        words2 = set(text2.split())
-        
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
-        
-        return intersection / union if union > 0 else 0
+    def get_ranked_results(queryset, ranking):
+        """Load ranked `(product_id, score)` pairs in one query, keeping their order."""
+        products = queryset.filter(id__in=[product_id for product_id, _ in ranking]) \
+            .select_related('category').in_bulk()
+
+        results = []
+        for product_id, score in ranking:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            results.append({
+                'id': product.id,
+                'title': product.title,
+                'description': product.description,
+                'category': product.category.name,
+                'similarity': round(score, 3)
+            })
+        return results
+
+    @staticmethod
+    def get_similar_products(queryset, search_query, top_k=10, category_id=None):
+        """Rank every product against the query with the TF-IDF similarity index."""
+        ranking = similarity_engine.top_k(search_query, top_k, category_id)
+        return ProductSearch.get_ranked_results(queryset, ranking)
 
     @staticmethod
     def search_products(queryset, search_query):
         if search_query:
-            products = queryset.filter(
-                Q(title__icontains=search_query) | 
-                Q(description__icontains=search_query)
-            ).distinct()
-
-            results = []
-            for product in products:
-                product_text = f"{product.title} {product.description}"
-                similarity = ProductSearch.get_text_similarity(search_query, product_text)
-
-                if search_query.lower() in product.title.lower():
-                    similarity += 0.3
-
-                results.append({
-                    'id': product.id,
-                    'title': product.title,
-                    'description': product.description,
-                    'category': product.category.name,
-                    'similarity': round(similarity, 3)
-                })
-
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            return {'lk': results}  
+            ranking = get_search_backend().search(search_query)
+            return {'lk': ProductSearch.get_ranked_results(queryset, ranking)}  
 
         return {'lk': []}
     
 class ProductListAPIView(APIView):
     pagination_class = ProductPagination
+    serializer = ProductListSerializer()
 
     def get_view_count_queryset(self):
-        queryset = Product.objects.all()
-        view_count_subquery = MostViewed.objects.filter(product=OuterRef('pk')) \
-            .values('product') \
-            .annotate(count=Count('id')) \
-            .values('count')
-        return queryset.annotate(view_count_annotation=Subquery(view_count_subquery))
+        # views_count is maintained incrementally, so ordering by it is an index scan
+        return Product.objects.annotate(view_count_annotation=F('views_count'))
 
-    def get_queryset(self, request):
+    def get_filtered_queryset(self, request):
         queryset = self.get_view_count_queryset()
         search_query = request.query_params.get('search')
         
         product_queryset = ProductQuerySet(queryset, self.handle_error)
         product_queryset.apply_search(search_query)
         product_queryset.apply_filters(request)
+        return product_queryset.queryset
+
+    def get_queryset(self, request):
+        queryset = self.get_filtered_queryset(request)
+
+        search_query = request.query_params.get('search')
+        if search_query and 'ordering' not in request.query_params:
+            # best matches first, ranked by the full-text index
+            return get_search_backend().annotate_rank(queryset, search_query).order_by('-search_rank', '-id')
 
         ordering = self.get_ordering(request)
-        return product_queryset.queryset.order_by(ordering) if not isinstance(ordering, Response) else ordering
+        return queryset.order_by(ordering, '-id') if not isinstance(ordering, Response) else ordering
 
     def get_ordering(self, request):
-        ordering = request.query_params.get('ordering', '-view_count_annotation') 
+        ordering = request.query_params.get('ordering', '-views_count') 
         ordering_options = {
             'newest': '-created',  
             'best_selling': '-sold',  
             'cheapest': 'price', 
-            'most_expensive': '-price'  
+            'most_expensive': '-price',
+            'trending': '-trending_score',
         }
-        
+
+        if ordering == 'trending':
+            return ordering_options[ordering]
+
         page = request.query_params.get('page')
         if page == 'store':
             if ordering in ordering_options:
@@ -279,16 +488,41 @@ class ProductListAPIView(APIView):
 
         return ordering
 
+    def get_paginator(self, request):
+        if request.query_params.get('pagination') == 'cursor':
+            return ProductCursorPagination()
+        return self.pagination_class()
+
+    def get_cache_tags(self, request):
+        if request.query_params.get('ordering') == 'trending':
+            # scores change without touching the columns of the validators
+            return ['product-list', 'product-trending']
+        return ['product-list']
+
+    def get_validators(self, request):
+        """
+        Every change to listed products bumps the list's cache tags, so
+        their versions are the ETag, with no query. There is no
+        Last-Modified: view counts change without touching `updated`.
+        """
+        tag_versions = response_cache.get_tag_versions(self.get_cache_tags(request))
+        etag = '-'.join(f'{tag}:{version}' for tag, version in sorted(tag_versions.items()))
+        return etag, None
+
+    @cache_response
     def get(self, request):
-        paginator = self.pagination_class()
+        paginator = self.get_paginator(request)
         
         try:
-            queryset = self.get_queryset(request)  
-            page = paginator.paginate_queryset(queryset, request)
-            
-            serializer = ProductSerializer(page, many=True)
-            
-            return paginator.get_paginated_response(serializer.data)
+            if isinstance(paginator, ProductCursorPagination):
+                # the cursor paginator applies its own keyset ordering
+                queryset = self.get_filtered_queryset(request)
+            else:
+                queryset = self.get_queryset(request)  
+            # read only, so rows skip model instances and the DRF field machinery
+            page = paginator.paginate_queryset(queryset.values(*self.serializer.columns), request)
+
+            return paginator.get_paginated_response(self.serializer.to_representation(page))
 
         except DatabaseError as db_error:
             return self.handle_error('Database error occurred: ' + str(db_error), status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -304,6 +538,25 @@ class ProductListAPIView(APIView):
 
 
 
+class ProductFacetsAPIView(ProductListAPIView):
+    """
+    API view to retrieve filter sidebar counts for the current search/filter state.
+    """
+
+    def get(self, request):
+        try:
+            queryset = self.get_filtered_queryset(request)
+            facets = ProductFacets(queryset).get(request.query_params)
+            return Response(facets, status=status.HTTP_200_OK)
+
+        except DatabaseError as db_error:
+            return self.handle_error('Database error occurred: ' + str(db_error), status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except ValidationError as val_error:
+            return self.handle_error('Validation error occurred: ' + str(val_error), status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.handle_error('An unexpected error occurred: ' + str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class ProductDetailAPIView(APIView):
     """
     API view to retrieve details of a specific product.
@@ -318,6 +571,24 @@ class ProductDetailAPIView(APIView):
             slug=slug
         )
 
+    def get_cache_tags(self, request, slug):
+        return [f'product:{slug}', 'related-products']
+
+    def get_validators(self, request, slug):
+        """
+        Galleries touch Product.updated and every view bumps views_count,
+        so these two columns version the whole detail response apart from
+        the related products, which are versioned by their cache tag.
+        """
+        product = Product.objects.filter(slug=slug).values('id', 'updated', 'views_count').first()
+        if product is None:
+            return None, None
+        related_version = response_cache.get_tag_versions(['related-products'])['related-products']
+        etag = f"{product['id']}-{product['updated'].timestamp()}-{product['views_count']}-{related_version}"
+        # no Last-Modified, `updated` misses view count changes
+        return etag, None
+
+    @cache_response
     def get(self, request, slug):
         """
         Handle GET requests to retrieve product details.
@@ -329,6 +600,12 @@ class ProductDetailAPIView(APIView):
         except Exception as e:
             return self.handle_error(f'An unexpected error occurred: {str(e)}')
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # cache hits and 304s never reach get(), but they are views too
+        if request.method == 'GET' and response.status_code in (200, 304) and request.user.is_authenticated:
+            view_recorder.record(kwargs['slug'], request.user.pk, get_client_ip(request))
+        return super().finalize_response(request, response, *args, **kwargs)
+
     def handle_error(self, message):
         """
         Centralized error handling method.
@@ -337,66 +614,112 @@ class ProductDetailAPIView(APIView):
 
 
 # search vectore
-# class ProductSearchView(APIView):
-#     def __init__(self, *args, **kwargs):
-#         super().__init__(*args, **kwargs)
-#         self.serializer_class = ProductSearchSerializer
-
-#     def get_text_similarity(self, text1, text2):
-#         """محاسبه شباهت متنی ساده"""
-#         text1 = re.sub(r'[^\w\s]', '', text1.lower())
-#         text2 = re.sub(r'[^\w\s]', '', text2.lower())
-        
-#         words1 = set(text1.split())
-#         words2 = set(text2.split())
-        
-#         intersection = len(words1.intersection(words2))
-#         union = len(words1.union(words2))
-        
-#         if union == 0:
-#             return 0
-#         return intersection / union
+class ProductSearchView(APIView):
+    """
+    API view to rank products by text similarity to a query.
+
+    Request Body:
+    {
+        "query": "...",  # Required
+        "top_k": 10,
+        "category_id": null
+    }
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.serializer_class = ProductSearchSerializer
 
-#     def post(self, request):
-#         query = request.data.get('query', '').strip()
-#         top_k = min(int(request.data.get('top_k', 10)), 100)
-#         category_id = request.data.get('category_id')
+    def post(self, request):
+        query = request.data.get('query', '').strip()
+        category_id = request.data.get('category_id')
 
-#         if not query:
-#             return Response({
-#                 'error': 'جستجو نمی‌تواند خالی باشد'
-#             }, status=400)
+        if not query:
+            return Response({
+                'error': 'جستجو نمی‌تواند خالی باشد'
+            }, status=400)
 
-#         base_queryset = Product.objects.all()
-#         if category_id:
-#             base_queryset = base_queryset.filter(category_id=category_id)
+        try:
+            top_k = min(int(request.data.get('top_k', 10)), 100)
+            if category_id is not None:
+                category_id = int(category_id)
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'top_k and category_id must be integers.'
+            }, status=400)
 
-#         products = base_queryset.filter(
-#             Q(title__icontains=query) |
-#             Q(description__icontains=query)
-#         ).distinct()
+        try:
+            results = ProductSearch.get_similar_products(
+                Product.objects.all(), query, top_k, category_id)
+            return Response(results)
+        except DatabaseError as db_error:
+            return Response({'error': 'Database error occurred: ' + str(db_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({'error': 'An unexpected error occurred: ' + str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-#         if not products.exists():
-#             return Response([])
 
-#         results = []
-#         for product in products:
-#             product_text = f"{product.title} {product.description}"
-            
-#             similarity = self.get_text_similarity(query, product_text)
-            
-#             if query.lower() in product.title.lower():
-#                 similarity += 0.3
-            
-#             results.append({
-#                 'id': product.id,
-#                 'title': product.title,
-#                 'description': product.description,
-#                 'category': product.category.name,
-#                 'similarity': round(similarity, 3)
-#             })
-
-#         results.sort(key=lambda x: x['similarity'], reverse=True)
-#         results = results[:top_k]
-
-#         return Response(results)
+# catalog export
+class ProductExportAPIView(APIView):
+    """
+    Staff-only streaming export of the whole catalog.
+
+    Query params:
+        output: 'ndjson' (default) or 'csv'
+        updated_since: ISO datetime, only products updated at or after it
+
+    The `X-Export-Started` header is the value to pass as `updated_since`
+    on the next incremental pull.
+    """
+    permission_classes = [IsAdminUser]
+    content_types = {
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.content_types:
+            return Response({'error': f'Invalid output format: {output}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = Product.objects.all()
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = parse_datetime(updated_since)
+            except ValueError:
+                updated_since = None
+            if updated_since is None:
+                return Response({'error': 'updated_since must be an ISO datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since)
+            queryset = queryset.filter(updated__gte=updated_since)
+
+        started = timezone.now()
+        exporter = ProductExporter(queryset, chunk_size=getattr(settings, 'PRODUCT_EXPORT_CHUNK_SIZE', 2000))
+        response = StreamingHttpResponse(getattr(exporter, output)(), content_type=self.content_types[output])
+        response['Content-Disposition'] = f'attachment; filename="products-{started:%Y%m%d%H%M%S}.{output}"'
+        response['X-Export-Started'] = started.isoformat()
+        return response
+
+
+# typeahead
+class ProductAutocompleteAPIView(APIView):
+    """
+    API view to suggest products and categories for a partial query.
+
+    Query params:
+        q: the text typed so far
+        limit: number of suggestions per group (default 10, max 20)
+    """
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            suggestions = autocomplete.suggest(request.query_params.get('q', ''), max(limit, 1))
+            return Response(suggestions, status=status.HTTP_200_OK)
+        except DatabaseError as db_error:
+            return Response({'error': 'Database error occurred: ' + str(db_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({'error': 'An unexpected error occurred: ' + str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
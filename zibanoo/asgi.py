@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zibanoo.settings')
 
 application = get_asgi_application()
+
+# load the autocomplete snapshot before the first request, not during it
+from products.autocomplete import autocomplete  # noqa: E402
+
+autocomplete.load()
@@ -0,0 +1,184 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# fails on an unreachable replica and on one that has no schema yet
+HEALTH_QUERY = 'SELECT 1 FROM django_migrations LIMIT 1'
+# models of the database cache backend
+CACHE_APP_LABEL = 'django_cache'
+# replicas are assumed to be at most this far behind the primary
+MAX_LAG = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+class RequestRouting:
+    """Routing state of the current request."""
+
+    def __init__(self, pinned=False):
+        self.use_replica = False
+        # set by a pin cookie or by any write during the request
+        self.pinned = pinned
+        self.wrote = False
+
+
+_routing = ContextVar('db_routing', default=None)
+
+
+@contextmanager
+def read_from_primary(changed=None):
+    """
+    Read from the primary inside the block while a replica may lag behind.
+
+    For reads whose result is cached under a version: `changed` is the
+    time the version was set, and a replica is trusted again once it has
+    had `MAX_LAG` seconds to catch up with it. Otherwise a lagging replica
+    would store stale rows as current, and serve them to the pinned writer
+    too. Without `changed` the block always reads from the primary.
+    """
+    routing = _routing.get()
+    if routing is None or (changed is not None and time.time() - changed > MAX_LAG):
+        yield
+        return
+    use_replica, routing.use_replica = routing.use_replica, False
+    try:
+        yield
+    finally:
+        routing.use_replica = use_replica
+
+
+class ReplicaPool:
+    """
+    Process-local health of the read replicas.
+
+    A replica is checked with a trivial query at most every
+    `check_interval` seconds; one that fails is skipped for
+    `retry_interval` seconds, and reads fall back to the primary when no
+    replica is healthy.
+    """
+
+    def __init__(self, aliases, check_interval=10, retry_interval=30):
+        self.aliases = list(aliases)
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        healthy = [alias for alias in self.aliases if self.is_healthy(alias)]
+        return random.choice(healthy) if healthy else None
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            state = self._checked.get(alias)
+        if state is not None and now < state[0]:
+            return state[1]
+
+        healthy = self.check(alias)
+        interval = self.check_interval if healthy else self.retry_interval
+        with self._lock:
+            self._checked[alias] = (now + interval, healthy)
+        return healthy
+
+    def check(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(HEALTH_QUERY)
+            return True
+        except DatabaseError as e:
+            logger.warning(f"Read replica {alias} is unavailable, reading from the primary: {e}")
+            connections[alias].close()
+            return False
+
+
+replicas = ReplicaPool(
+    getattr(settings, 'REPLICA_DATABASES', []),
+    check_interval=getattr(settings, 'REPLICA_CHECK_INTERVAL', 10),
+    retry_interval=getattr(settings, 'REPLICA_RETRY_INTERVAL', 30),
+)
+
+
+class ReplicaRouter:
+    """
+    Send the reads of catalog and content views to the read replicas.
+
+    Only requests marked by `ReplicaMiddleware` read from a replica;
+    management commands, background threads and every other view keep
+    using the primary. Reads inside a transaction and reads after the
+    request wrote anything go to the primary too, so a request always
+    sees its own writes. The database cache always lives on the primary,
+    and its writes do not pin the request. Reads that fill a cache right
+    after a change run under `read_from_primary`.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.use_replica or routing.pinned:
+            return None
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replicas.choose()
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and model._meta.app_label != CACHE_APP_LABEL:
+            routing.pinned = routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas.aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in replicas.aliases:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Mark safe requests to the `REPLICA_APPS` views for replica reads.
+
+    A request that writes sets a short-lived cookie, and requests carrying
+    it read from the primary until it expires, so a user sees their own
+    changes even while the replicas lag behind.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.apps = set(getattr(settings, 'REPLICA_APPS', []))
+        self.cookie_name = getattr(settings, 'REPLICA_PIN_COOKIE', 'db_pin')
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+    def __call__(self, request):
+        routing = RequestRouting(pinned=self.cookie_name in request.COOKIES)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+        if routing.wrote and request.method not in SAFE_METHODS:
+            response.set_cookie(self.cookie_name, '1', max_age=self.pin_seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _routing.get()
+        if routing is not None and request.method in SAFE_METHODS and replicas.aliases \
+                and view_func.__module__.split('.')[0] in self.apps:
+            routing.use_replica = True
@@ -62,6 +62,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'zibanoo.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,8 +105,46 @@ DATABASES = {
     }
 }
 
+# Read replicas, comma separated SQLite files; a copy of db.sqlite3 works for local testing
+for index, replica in enumerate(filter(None, os.environ.get('db_replicas', '').split(','))):
+    DATABASES[f'replica_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# GET requests to the views of these apps read from the replicas
+DATABASE_ROUTERS = ['zibanoo.db_router.ReplicaRouter']
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+REPLICA_APPS = ['products', 'blogs', 'comments', 'rating']
+# a user's requests read from the primary for this long after they write, and
+# caches are filled from the primary for this long after a change: the
+# replicas are assumed to be at most this far behind
+REPLICA_PIN_SECONDS = 5
+
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Caches must be shared by every worker and management command: response
+# cache tags, catalog versions and the category tree are invalidated from
+# whichever process changed the data. Redis by default, so a cache hit costs
+# no database query; cache_url=db uses the database cache instead, on the
+# primary (`manage.py createcachetable`).
+if os.environ.get('cache_url', '') != 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('cache_url') or 'redis://127.0.0.1:6379/0',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+
 
 
 # DATABASES = {
@@ -116,7 +155,16 @@ CORS_ALLOW_ALL_ORIGINS = True
 #         'PASSWORD': os.environ.get('db_password'),
 #         'HOST': os.environ.get('db_host'),
 #         'PORT': os.environ.get('db_port'),
-#     }
+#     },
+#     'replica_0': {
+#         'ENGINE': 'django.db.backends.postgresql',
+#         'NAME': 'ZIBANOO',
+#         'USER': os.environ.get('db_user'),
+#         'PASSWORD': os.environ.get('db_password'),
+#         'HOST': os.environ.get('db_replica_host'),
+#         'PORT': os.environ.get('db_port'),
+#         'TEST': {'MIRROR': 'default'},
+#     },
 # }
 
 # Password validation
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zibanoo.settings')
 
 application = get_wsgi_application()
+
+# load the autocomplete snapshot before the first request, not during it
+from products.autocomplete import autocomplete  # noqa: E402
+
+autocomplete.load()